@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Scriptter benchmarks
+
+Usage:
+    benchmarks.py memory [--items <count>] [--format <format>]
+    benchmarks.py load [--items <count>] [--repeat <count>]
+    benchmarks.py fleet [--schedules <count>] [--length <count>] [--ticks <count>] [--cadence <seconds>] [--mode <mode>] [--action <action>]
+
+Options:
+    -h --help              Show this screen.
+    --items <count>        Number of schedule items to generate [default: 100000]
+    --repeat <count>       Number of timed runs, keeping the best [default: 3]
+    --format <format>      Schedule format for the memory benchmark [default: yaml]
+    --schedules <count>    Number of schedules in the fleet [default: 100]
+    --length <count>       Number of items in each fleet schedule [default: 20]
+    --ticks <count>        Number of times to run every schedule [default: 10]
+    --cadence <seconds>    Time from the start of one tick to the next [default: 0]
+    --mode <mode>          How to run the schedules: process, inprocess or scheduleset [default: inprocess]
+    --action <action>      What each item does: noop or sleep [default: noop]
+"""  # noqa
+from collections import OrderedDict
+import datetime as dt
+import functools
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from docopt import docopt
+from path import path
+from six.moves import range
+
+import scriptter
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+PATH = path(__file__).abspath().dirname()
+
+ACCOUNTS = ['Abbott', 'Costello', 'Naturally', 'Tomorrow']
+DELAYS = ['1min', '30s', '10min', 'tomorrow at 8am']
+
+
+def generate_items(count):
+    for n in range(count):
+        yield OrderedDict([
+            ('as', ACCOUNTS[n % len(ACCOUNTS)]),
+            ('say', "@%s Who's on first? (%s)" % (ACCOUNTS[n % 3], n)),
+            ('delay', DELAYS[n % len(DELAYS)]),
+        ])
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'current': current, 'peak': peak}
+
+
+def memory(count, fmt='yaml'):
+    tmpdir = path(tempfile.mkdtemp())
+    try:
+        schedule_path = tmpdir / ('schedule.' + fmt)
+        defaults = OrderedDict([('defaults', OrderedDict(delay='1min'))])
+        scriptter.dump_all(
+            itertools.chain([defaults], generate_items(count)), schedule_path)
+
+        # Measure the whole path from the file, the way `scriptter` does it.
+        def build(schedule_class, stream):
+            loaded = scriptter.ScheduleLoader(schedule_path, stream=stream)
+            return schedule_class(loaded.options, loaded.items)
+
+        report = OrderedDict()
+        report['items'] = count
+        report['format'] = fmt
+        report['schedule'] = measure(
+            lambda: build(scriptter.Schedule, False))
+        report['compact'] = measure(
+            lambda: build(scriptter.CompactSchedule, True))
+        report['ratio'] = (
+            float(report['compact']['peak']) / report['schedule']['peak'])
+        return report
+    finally:
+        tmpdir.rmtree_p()
+
+
+def load(count, repeat=3):
+    tmpdir = path(tempfile.mkdtemp())
+    try:
+        defaults = OrderedDict([('defaults', OrderedDict(delay='1min'))])
+        documents = [defaults] + list(generate_items(count))
+        report = OrderedDict()
+        report['items'] = count
+        for extension in ('yaml', 'jsonl', 'msgpack'):
+            if extension == 'msgpack' and scriptter.msgpack is None:
+                continue
+            schedule_path = tmpdir / ('schedule.' + extension)
+            scriptter.dump_all(documents, schedule_path)
+            report[extension] = min(timeit.repeat(
+                lambda: scriptter.ScheduleLoader(schedule_path),
+                number=1, repeat=repeat))
+        return report
+    finally:
+        tmpdir.rmtree_p()
+
+
+# A realistic mix of delays for fleet schedules, most of them short.
+FLEET_DELAYS = ['10s', '30s', '30s', '1min', '1min', '5min', 'tomorrow at 8am']
+
+
+def noop_action(context):
+    pass
+
+
+def sleep_action(context):
+    time.sleep(0.01)
+
+
+def generate_fleet(tmpdir, count, length, action='noop', spread=1, seed=0):
+    rand = random.Random(seed)
+    now = dt.datetime.utcnow()
+    fleet = []
+    for n in range(count):
+        schedule_path = tmpdir / ('schedule-%d.yaml' % n)
+        state_path = tmpdir / ('state-%d.yaml' % n)
+        defaults = OrderedDict([('defaults', OrderedDict([
+            ('call', 'benchmarks:%s_action' % action),
+            ('timezone', 'UTC'),
+        ]))])
+        items = list(generate_items(length))
+        for item in items:
+            item['delay'] = rand.choice(FLEET_DELAYS)
+        scriptter.dump_all([defaults] + items, schedule_path)
+
+        # Start every schedule somewhere in the middle, coming due at some
+        # point during the first `spread` seconds of the run.
+        schedule = scriptter.Schedule(defaults['defaults'], items)
+        state = OrderedDict([
+            ('scheduled', schedule.items[rand.randrange(length)]['id']),
+            ('when', now + dt.timedelta(seconds=rand.uniform(0, spread))),
+        ])
+        state_path.write_text(scriptter.yaml_dump(state))
+        fleet.append((schedule_path, state_path))
+    return fleet
+
+
+def read_state(state_path):
+    state = scriptter.yaml_load(state_path)
+    return state.get('scheduled'), state.get('when')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_schedule(mode, schedule_path, state_path):
+    argv = ['--state', state_path, 'run', schedule_path]
+    if mode == 'process':
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                [sys.executable, scriptter.__file__] + argv,
+                stderr=devnull, cwd=PATH)
+    else:
+        scriptter.main(argv)
+
+
+def timed(run, *args):
+    """Wall and CPU seconds (including child processes) taken by `run`."""
+    cpu_start, started = os.times(), time.time()
+    run(*args)
+    elapsed, cpu_end = time.time() - started, os.times()
+    return elapsed, sum(cpu_end[:4]) - sum(cpu_start[:4])
+
+
+def tick_each(mode, schedules):
+    """Run every schedule once, on its own, timing only the runs."""
+    busy = cpu = 0
+    lateness = []
+    for schedule_path, state_path in schedules:
+        # Reading state to measure lateness is not part of the run.
+        before = read_state(state_path)
+        fired = dt.datetime.utcnow()
+        elapsed, used = timed(run_schedule, mode, schedule_path, state_path)
+        busy += elapsed
+        cpu += used
+        if read_state(state_path)[0] != before[0]:
+            lateness.append((fired - before[1]).total_seconds())
+    return busy, cpu, lateness
+
+
+class ScheduleSetTicker(object):
+    """Run the fleet from one long-lived `ScheduleSet`, the batch API."""
+    def __init__(self, schedules):
+        self.schedules = scriptter.ScheduleSet(
+            executor=scriptter.SubprocessExecutor())
+        self.states = []
+        for schedule_path, state_path in schedules:
+            state = scriptter.StateLoader(state_path)
+            self.states.append(state)
+            self.schedules.load(schedule_path, schedule_path, state.state)
+
+    def run(self):
+        now = self.schedules.get_now()
+        due = self.schedules.run(now)
+        for state in self.states:
+            state.write_state()
+        self.lateness = [(now - d.when).total_seconds() for d in due]
+
+    def __call__(self):
+        busy, cpu = timed(self.run)
+        return busy, cpu, self.lateness
+
+
+def fleet(count, length, ticks, cadence=0, mode='inprocess', action='noop',
+          spread=None):
+    if spread is None:
+        spread = max(1, cadence * ticks)
+    tmpdir = path(tempfile.mkdtemp())
+    logging.disable(logging.CRITICAL)
+    try:
+        schedules = generate_fleet(
+            tmpdir, count, length, action=action, spread=spread)
+        setup = None
+        if mode == 'scheduleset':
+            # Loading every schedule happens once, not on every tick.
+            started = time.time()
+            tick = ScheduleSetTicker(schedules)
+            setup = time.time() - started
+        else:
+            tick = functools.partial(tick_each, mode, schedules)
+
+        durations = []
+        lateness = []
+        cpu = 0
+        for n in range(ticks):
+            started = time.time()
+            busy, used, fired = tick()
+            durations.append(busy)
+            cpu += used
+            lateness.extend(fired)
+            if n < ticks - 1:
+                time.sleep(max(0, cadence - (time.time() - started)))
+    finally:
+        logging.disable(logging.NOTSET)
+        tmpdir.rmtree_p()
+
+    runs = count * ticks
+    report = OrderedDict()
+    report['mode'] = mode
+    report['action'] = action
+    report['schedules'] = count
+    report['ticks'] = ticks
+    report['runs'] = runs
+    report['fired'] = len(lateness)
+    report['runs_per_second'] = runs / sum(durations)
+    report['tick_seconds'] = OrderedDict([
+        ('p50', percentile(durations, 0.5)),
+        ('p99', percentile(durations, 0.99)),
+        ('max', max(durations)),
+    ])
+    report['lateness_seconds'] = OrderedDict([
+        ('p50', percentile(lateness, 0.5)),
+        ('p99', percentile(lateness, 0.99)),
+    ])
+    report['cpu_seconds_per_tick'] = cpu / ticks
+    if setup is not None:
+        report['setup_seconds'] = setup
+    if resource is not None:
+        # Kilobytes on Linux, bytes on OS X.
+        report['peak_rss'] = OrderedDict([
+            ('self', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+            ('children',
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+        ])
+    return report
+
+
+def main():  # pragma: no cover
+    arguments = docopt(__doc__)
+    if arguments['memory']:
+        if tracemalloc is None:
+            raise SystemExit('The memory benchmark requires tracemalloc.')
+        report = memory(int(arguments['--items']), arguments['--format'])
+    elif arguments['load']:
+        report = load(int(arguments['--items']), int(arguments['--repeat']))
+    elif arguments['fleet']:
+        report = fleet(
+            int(arguments['--schedules']), int(arguments['--length']),
+            int(arguments['--ticks']), cadence=float(arguments['--cadence']),
+            mode=arguments['--mode'], action=arguments['--action'])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
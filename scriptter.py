@@ -5,8 +5,13 @@
 Scriptter is a brain for your cron job.
 
 Usage:
-    scriptter [--reset] [--verbose] [--state <state-path>] [trial | run] <schedule>
-    scriptter [--verbose] check <schedule>
+    scriptter [--verbose] [--journal <journal-dir>] [--since <time>] [--schedule <schedule-path>] history
+    scriptter [--reset] [--verbose] [--compact] [--format <format>] [--state <state-path>] [--trace <trace-path>] [--journal <journal-dir>] [trial | run] <schedule>
+    scriptter [--verbose] [--compact] [--format <format>] check <schedule>
+    scriptter [--verbose] [--compact] [--format <format>] [--state <state-path>] resync <schedule>
+    scriptter [--verbose] [--compact] [--format <format>] [--state <state-path>] [--days <days>] [--cadence <minutes>] [--start <time>] simulate <schedule>
+    scriptter [--verbose] [--format <format>] convert <schedule> <output>
+    scriptter [--verbose] [--format <format>] [--bucket <seconds>] [--period <seconds>] histogram <schedules>...
 
 Options:
     -h --help              Show this screen.
@@ -14,24 +19,64 @@ Options:
     --verbose              Show verbose output.
     --state <state-path>   Path for storing state [default: "./state.yml"]
     --reset                Reset stored state
+    --trace <trace-path>   Append a trace of each run to this file, as OTLP JSON lines
+    --journal <journal-dir>  Record everything run in this directory (history reads ./journal by default)
+    --since <time>         Show history from this time (UTC) on
+    --schedule <schedule-path>  Show history for this schedule only
+    --compact              Use compact storage for very large schedules
+    --format <format>      Schedule format: yaml, jsonl or msgpack (default: by file extension)
+    --days <days>          Number of days to simulate [default: 7]
+    --cadence <minutes>    Minutes between simulated runs [default: 1]
+    --start <time>         When to start the simulation [default: now]
+    --bucket <seconds>     Width of each histogram bar [default: 1]
+    --period <seconds>     Period of the histogram [default: 60]
 """  # noqa
-from collections import deque, Iterable, Mapping, OrderedDict
+from array import array
+import binascii
+import bisect
+import copy
+from collections import (
+    deque, namedtuple, Iterable, Mapping, OrderedDict, Sequence)
 from codecs import open
 import datetime as dt
+import errno
 import hashlib
+import heapq
+import importlib
+import io
 import itertools as it
+import json
 import logging
+import os
 import pprint
+import random
+import re
+import select
 import shlex
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 
 from docopt import docopt
 from path import path
 import parsedatetime
 import pytz
 import six
+from six.moves import http_client
+from six.moves.urllib import parse as urlparse
 import yaml
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 __version__ = "0.3"
 
 
@@ -64,9 +109,9 @@ def _dict_representer(dumper, data):
 OrderedDumper.add_representer(OrderedDict, _dict_representer)
 
 
-def _load_yaml(method, data):
+def _load_yaml(method, data, lazy=False):
     result = getattr(yaml, method)(data, Loader=OrderedLoader)
-    if method == 'load_all':
+    if method == 'load_all' and not lazy:
         result = deque(result)
     return result
 
@@ -95,6 +140,160 @@ def yaml_load_all(data):
     return result if result is not None else deque()
 
 
+def _is_file_path(data):
+    return (
+        isinstance(data, six.string_types) and
+        len(data.strip().splitlines()) == 1 and
+        path(data).exists()
+    )
+
+
+def _load_yaml_documents(stream):
+    return _load_yaml('load_all', stream, lazy=True)
+
+
+_ISO_DATETIME = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})(\.\d{1,6})?'
+    r'(Z|[+-]\d{2}:\d{2})?$')
+
+
+def _encode_time(value):
+    """Write dates and times, which JSON and MessagePack lack, as ISO 8601
+    strings.
+    """
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    raise TypeError('%r is not serializable' % (value,))
+
+
+def _decode_time(value):
+    """Read ISO 8601 date-time strings back as naive UTC datetimes, just as
+    YAML loads its timestamps.
+    """
+    if isinstance(value, list):
+        return [_decode_time(v) for v in value]
+    elif not isinstance(value, six.string_types):
+        return value
+    match = _ISO_DATETIME.match(value)
+    if match is None:
+        return value
+    date, clock, fraction, offset = match.groups()
+    when = dt.datetime.strptime(date + ' ' + clock, '%Y-%m-%d %H:%M:%S')
+    if fraction:
+        when += dt.timedelta(microseconds=int(fraction[1:].ljust(6, '0')))
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        when -= sign * dt.timedelta(
+            hours=int(offset[1:3]), minutes=int(offset[4:6]))
+    return when
+
+
+def _decode_times(pairs):
+    return OrderedDict((key, _decode_time(value)) for key, value in pairs)
+
+
+def _load_jsonl(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line, object_pairs_hook=_decode_times)
+
+
+def _load_msgpack(stream):
+    if msgpack is None:
+        raise ImportError('Loading MessagePack schedules requires msgpack')
+    try:
+        unpacker = msgpack.Unpacker(
+            stream, object_pairs_hook=_decode_times, raw=False)
+    except TypeError:  # pragma: no cover
+        # Older versions of msgpack.
+        unpacker = msgpack.Unpacker(
+            stream, object_pairs_hook=_decode_times, encoding='utf-8')
+    for document in unpacker:
+        yield document
+
+
+def _iter_file_path_or_stream(load, data, binary=False):
+    if _is_file_path(data):
+        if binary:
+            fi = io.open(data, 'rb')
+        else:
+            fi = open(data, encoding='utf-8')
+        with fi:
+            for document in load(fi):
+                yield document
+    elif binary and isinstance(data, six.binary_type):
+        for document in load(io.BytesIO(data)):
+            yield document
+    elif isinstance(data, six.string_types):
+        for document in load(data.splitlines()):
+            yield document
+    else:
+        for document in load(data):
+            yield document
+
+
+FORMATS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.msgpack': 'msgpack',
+    '.mpk': 'msgpack',
+}
+
+
+def guess_format(data):
+    name = data
+    if not isinstance(data, six.string_types):
+        name = getattr(data, 'name', None)
+    if (isinstance(name, six.string_types) and
+            len(name.strip().splitlines()) == 1):
+        return FORMATS.get(path(name).ext.lower(), 'yaml')
+    return 'yaml'
+
+
+def load_all(data, fmt=None):
+    """Stream the documents of a schedule in any supported format."""
+    if fmt is None:
+        fmt = guess_format(data)
+    if fmt == 'yaml':
+        if _is_file_path(data):
+            return _iter_file_path_or_stream(_load_yaml_documents, data)
+        return yaml_load_all(data)
+    elif fmt == 'jsonl':
+        return _iter_file_path_or_stream(_load_jsonl, data)
+    elif fmt == 'msgpack':
+        return _iter_file_path_or_stream(_load_msgpack, data, binary=True)
+    raise ValueError('Unknown schedule format: %s' % fmt)
+
+
+def dump_all(documents, output_path, fmt=None):
+    if fmt is None:
+        fmt = guess_format(output_path)
+    if fmt == 'yaml':
+        with io.open(output_path, 'w', encoding='utf-8') as fo:
+            yaml.dump_all(
+                documents, fo, Dumper=OrderedDumper,
+                default_flow_style=False, allow_unicode=True)
+    elif fmt == 'jsonl':
+        with io.open(output_path, 'w', encoding='utf-8') as fo:
+            for document in documents:
+                fo.write(six.text_type(
+                    json.dumps(
+                        document, ensure_ascii=False, default=_encode_time)))
+                fo.write(u'\n')
+    elif fmt == 'msgpack':
+        if msgpack is None:
+            raise ImportError('Writing MessagePack schedules requires msgpack')
+        with io.open(output_path, 'wb') as fo:
+            for document in documents:
+                fo.write(msgpack.packb(
+                    document, use_bin_type=True, default=_encode_time))
+    else:
+        raise ValueError('Unknown schedule format: %s' % fmt)
+
+
 def yaml_dump(data):
     return yaml.dump(data, Dumper=OrderedDumper, default_flow_style=False)
 
@@ -126,11 +325,112 @@ DEFAULTS = {
     'repeat': True,
 }
 
+# In order of precedence among the defaults.
+ACTION_TYPES = ('call', 'http', 'cmd')
+
+# Schedule options needed to run from a plan, without the schedule.
+PLAN_OPTIONS = (
+    'name', 'timezone', 'lookahead', 'resync', 'idempotent_window')
+
+# Jitter never pushes a run back by more than this fraction of its delay.
+JITTER_LIMIT = 0.1
+
+RETRY_DEFAULTS = {
+    'attempts': 3,
+    'backoff': '1 minute',
+    'factor': 2,
+    'jitter': 0.1,
+}
+
+
+def _file_digest(file_path):
+    with open(file_path, 'rb') as fi:
+        return hashlib.md5(fi.read()).hexdigest()
+
+
+def sources_unchanged(sources):
+    """Whether every file in `sources` still has the digest recorded."""
+    if not sources:
+        return False
+    try:
+        return all(
+            _file_digest(file_path) == digest
+            for file_path, digest in sources.items())
+    except (IOError, OSError):
+        return False
+
+
+class FragmentCache(object):
+    """Parsed shared YAML fragments, keyed by a hash of their content."""
+    def __init__(self):
+        self.parsed = {}
+        self.digests = {}
+        self.dependents = {}
+
+    def read(self, fragment_path):
+        with open(fragment_path, 'rb') as fi:
+            content = fi.read()
+        return hashlib.md5(content).hexdigest(), content
+
+    def load(self, fragment_path, dependent=None):
+        fragment_path = path(fragment_path).abspath()
+        digest, content = self.read(fragment_path)
+        previous = self.digests.get(fragment_path)
+        self.digests[fragment_path] = digest
+        if previous is not None and previous != digest:
+            self.evict(previous)
+        dependents = self.dependents.setdefault(fragment_path, set())
+        if dependent is not None:
+            dependents.add(dependent)
+
+        if digest not in self.parsed:
+            logger.debug('Parsing fragment %s', fragment_path)
+            fragment = _load_yaml('load', content.decode('utf-8')) or {}
+            self.parsed[digest] = fragment.get('defaults', fragment)
+        return digest, self.parsed[digest]
+
+    def evict(self, digest):
+        """Forget a parsed fragment, unless some path still has it."""
+        if digest not in self.digests.values():
+            self.parsed.pop(digest, None)
+
+    def invalidate(self):
+        """Forget any fragments that have changed on disk.
+
+        Returns the set of schedules that depend on a changed fragment.
+        """
+        stale = set()
+        for fragment_path, digest in list(self.digests.items()):
+            try:
+                current = self.read(fragment_path)[0]
+            except IOError:
+                current = None
+            if current != digest:
+                stale.update(self.dependents.pop(fragment_path, ()))
+                del self.digests[fragment_path]
+                self.evict(digest)
+        return stale
+
+
+FRAGMENTS = FragmentCache()
+
 
 class ScheduleLoader(object):
-    def __init__(self, schedule_path):
+    """Load a schedule's options and items.
+
+    With `stream`, `items` is an iterator that reads each item from the file
+    as it is needed, so that a `CompactSchedule` can be built without ever
+    holding every item as a dictionary.
+    """
+    def __init__(self, schedule_path, fragments=FRAGMENTS, fmt=None,
+                 stream=False):
         self.file_path = schedule_path
-        options, items = self.extract_options_and_schedule_items(schedule_path)
+        self.fragments = fragments
+        self.dependencies = OrderedDict()
+        options, items = self.extract_options_and_schedule_items(
+            schedule_path, fmt=fmt, stream=stream)
+
+        options = self.extend_options(options, self.get_base_dir())
 
         self.loaded_options = options
         self.options = OrderedDict()
@@ -140,28 +440,106 @@ class ScheduleLoader(object):
         self.items = items
 
     @classmethod
-    def extract_options_and_schedule_items(klass, data):
-        schedule = yaml_load_all(data)
+    def extract_options_and_schedule_items(klass, data, fmt=None,
+                                           stream=False):
+        schedule = iter(load_all(data, fmt))
         options = {}
         items = []
 
         # Get first item, see if it contains defaults:
-        item = schedule.popleft()
+        item = next(schedule)
         if 'defaults' in item:
             options = item['defaults']
         else:
             items.append(item)
 
         # Everything else is a schedule item.
-        items.extend(schedule)
+        if stream:
+            items = it.chain(items, schedule)
+        else:
+            items.extend(schedule)
 
         return options, items
 
+    def get_sources(self):
+        """Digests of the schedule file and every fragment it extends."""
+        sources = OrderedDict()
+        if _is_file_path(self.file_path):
+            file_path = six.text_type(path(self.file_path).abspath())
+            sources[file_path] = _file_digest(file_path)
+        sources.update(
+            (six.text_type(fragment_path), digest)
+            for fragment_path, digest in self.dependencies.items())
+        return sources
+
+    def get_base_dir(self):
+        if isinstance(self.file_path, six.string_types):
+            file_path = path(self.file_path)
+            if len(self.file_path.splitlines()) == 1 and file_path.exists():
+                return file_path.abspath().dirname()
+        return path.getcwd()
+
+    def extend_options(self, options, base_dir, seen=()):
+        extends = options.get('extends')
+        if not extends:
+            return options
+        elif isinstance(extends, six.string_types):
+            extends = [extends]
+
+        extended = OrderedDict()
+        for fragment_path in extends:
+            fragment_path = (base_dir / fragment_path).abspath()
+            if fragment_path in seen:
+                raise ValueError('Circular extends: %s' % fragment_path)
+            digest, fragment = self.fragments.load(
+                fragment_path, dependent=path(self.file_path).abspath())
+            self.dependencies[fragment_path] = digest
+            extended.update(self.extend_options(
+                fragment, fragment_path.dirname(), seen + (fragment_path,)))
+
+        extended.update(
+            (key, value) for key, value in options.items()
+            if key != 'extends')
+        return extended
+
+
+def get_schedule_identity(name, options=None):
+    """What identifies a schedule however it is referred to.
+
+    That is the schedule's own `name` option, if it has one, or else the real
+    path of its file, so that `a.yaml` and `./a.yaml` are the same schedule.
+    """
+    if options is None and _is_file_path(name):
+        options = ScheduleLoader(name, stream=True).options
+    if options and options.get('name'):
+        return options['name']
+    elif _is_file_path(name):
+        return six.text_type(path(name).realpath())
+    return name
+
+
+class Clock(object):
+    def utcnow(self):
+        return dt.datetime.utcnow()
+
+
+class SimulatedClock(Clock):
+    def __init__(self, start=None):
+        self.now = start if start is not None else dt.datetime.utcnow()
+
+    def utcnow(self):
+        return self.now
+
+    def advance(self, delta):
+        self.now += delta
+
 
 class Schedule(object):
-    def __init__(self, options, items):
+    def __init__(self, options, items, clock=None, name=None):
         self.options = options
         self.items = items
+        self.clock = clock if clock is not None else Clock()
+        self.name = name
         self.by_id = {}
         self.next_after_id = {}
 
@@ -170,11 +548,22 @@ class Schedule(object):
     def get_timezone(self):
         return pytz.timezone(self.options['timezone'])
 
+    _identity = None
+
+    def get_identity(self):
+        # The identity may mean finding the real path of the file, so it is
+        # only worked out again if the name changes.
+        key = (self.name, self.options.get('name'))
+        if self._identity is None or self._identity[0] != key:
+            self._identity = (
+                key, get_schedule_identity(self.name, self.options))
+        return self._identity[1]
+
     def localize_naive_utc_datetime(self, time):
         return pytz.UTC.localize(time).astimezone(self.get_timezone())
 
     def get_now(self):
-        return self.localize_naive_utc_datetime(dt.datetime.utcnow())
+        return self.localize_naive_utc_datetime(self.clock.utcnow())
 
     def index(self):
         self.by_id.clear()
@@ -205,19 +594,307 @@ class Schedule(object):
         return hashlib.md5(repr(item).encode('utf-8')).hexdigest()
 
 
+def _intern(value):
+    # On Python 2, only byte strings may be interned.
+    if isinstance(value, str):
+        return six.moves.intern(value)
+    return value
+
+
+def _pack_id(item_id):
+    # md5 hex ids are stored as 16 raw bytes; anything else is kept as-is.
+    if isinstance(item_id, six.string_types) and len(item_id) == 32:
+        try:
+            return binascii.unhexlify(item_id)
+        except (TypeError, ValueError):
+            pass
+    return item_id
+
+
+def _unpack_id(packed):
+    if isinstance(packed, six.binary_type) and len(packed) == 16:
+        return binascii.hexlify(packed).decode('ascii')
+    return packed
+
+
+class CompactItem(Mapping):
+    """A read-only view of one row in a `CompactSchedule`."""
+    __slots__ = ('_schedule', '_index')
+
+    def __init__(self, schedule, index):
+        self._schedule = schedule
+        self._index = index
+
+    def __getitem__(self, key):
+        if key == 'id':
+            return _unpack_id(self._schedule.ids[self._index])
+        value = self._schedule.columns[key][self._index]
+        if value is SENTINEL:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        index = self._index
+        columns = self._schedule.columns
+        for key in self._schedule.keys:
+            if columns[key][index] is not SENTINEL:
+                yield key
+        yield 'id'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'CompactItem(%r)' % dict(self)
+
+
+class CompactItems(Sequence):
+    __slots__ = ('_schedule',)
+
+    def __init__(self, schedule):
+        self._schedule = schedule
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return CompactItem(self._schedule, index)
+
+    def __len__(self):
+        return len(self._schedule.ids)
+
+
+class CompactItemsById(Mapping):
+    __slots__ = ('_schedule',)
+
+    def __init__(self, schedule):
+        self._schedule = schedule
+
+    def position(self, item_id):
+        return self._schedule.positions[_pack_id(item_id)]
+
+    def __getitem__(self, item_id):
+        return CompactItem(self._schedule, self.position(item_id))
+
+    def __iter__(self):
+        return (_unpack_id(packed) for packed in self._schedule.positions)
+
+    def __len__(self):
+        return len(self._schedule.positions)
+
+
+class CompactNextAfterId(CompactItemsById):
+    __slots__ = ()
+
+    def __getitem__(self, item_id):
+        index = self._schedule.next_after[self.position(item_id)]
+        if index < 0:
+            raise KeyError(item_id)
+        return CompactItem(self._schedule, index)
+
+    def __iter__(self):
+        next_after = self._schedule.next_after
+        for packed, index in self._schedule.positions.items():
+            if next_after[index] >= 0:
+                yield _unpack_id(packed)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class CompactSchedule(Schedule):
+    """A `Schedule` for very large item lists.
+
+    Items are stored column-wise, one list per key, with interned keys,
+    binary ids and an integer `next_after` array. `items`, `by_id` and
+    `next_after_id` are read-only mapping views over that storage, so the
+    rest of Scriptter can't tell the difference.
+    """
+    def __init__(self, options, items, clock=None, name=None):
+        self.options = options
+        self.clock = clock if clock is not None else Clock()
+        self.name = name
+        self.keys = []
+        self.columns = {}
+        self.ids = []
+        self.positions = {}
+        self.next_after = array('l')
+        self._values = {}
+
+        for item in items:
+            self.append(item)
+
+        self.items = CompactItems(self)
+        self.by_id = CompactItemsById(self)
+        self.next_after_id = CompactNextAfterId(self)
+
+        self.index()
+
+    def append(self, item):
+        index = len(self.ids)
+        item_id = item['id'] if 'id' in item else self.hash_item(item)
+        for key, value in item.items():
+            if key == 'id':
+                continue
+            column = self.columns.get(key)
+            if column is None:
+                key = _intern(key)
+                self.keys.append(key)
+                column = self.columns[key] = [SENTINEL] * index
+            if isinstance(value, six.string_types) and len(value) < 64:
+                value = self._values.setdefault(value, value)
+            column.append(value)
+        for column in self.columns.values():
+            if len(column) == index:
+                column.append(SENTINEL)
+
+        packed = _pack_id(item_id)
+        self.ids.append(packed)
+        self.positions[packed] = index
+
+    def index(self):
+        count = len(self.ids)
+        self.next_after = array('l', range(1, count + 1))
+        if count:
+            self.next_after[-1] = 0 if self.options.get('repeat') else -1
+
+
+class PlannedSchedule(Schedule):
+    """Stands in for a schedule, using the plan stored in state.
+
+    Only the planned items are known. `complete` means they run to the end of
+    the schedule; `cycle` means they are one whole cycle of a repeating one.
+    """
+    def __init__(self, plan, clock=None, name=None):
+        self.plan = plan
+        self.complete = plan.get('complete', False)
+        self.cycle = plan.get('cycle', False)
+        super(PlannedSchedule, self).__init__(
+            plan['options'], plan['items'], clock=clock, name=name)
+
+    def index(self):
+        self.by_id = dict((item['id'], item) for item in self.items)
+        self.next_after_id = dict(
+            (item['id'], next_item)
+            for item, next_item in zip(self.items, self.items[1:]))
+        if self.cycle and self.items:
+            self.next_after_id[self.items[-1]['id']] = self.items[0]
+
+
+class State(OrderedDict):
+    """Stored state that knows whether it has changed since it was loaded.
+
+    Only assignments to top-level keys are tracked, so reassign a key after
+    changing a nested value in place.
+    """
+    def __init__(self, *args, **kwargs):
+        super(State, self).__init__(*args, **kwargs)
+        self.dirty = False
+
+    def __setitem__(self, key, value, *args, **kwargs):
+        try:
+            changed = key not in self or self[key] != value
+        except TypeError:
+            # Naive and aware datetimes can't be compared on Python 2.
+            changed = True
+        if changed:
+            self.dirty = True
+        super(State, self).__setitem__(key, value, *args, **kwargs)
+
+    def __delitem__(self, key, *args, **kwargs):
+        super(State, self).__delitem__(key, *args, **kwargs)
+        self.dirty = True
+
+    def pop(self, key, *args):
+        if key in self:
+            self.dirty = True
+        return super(State, self).pop(key, *args)
+
+    def popitem(self, *args, **kwargs):
+        result = super(State, self).popitem(*args, **kwargs)
+        self.dirty = True
+        return result
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        if self:
+            self.dirty = True
+        super(State, self).clear()
+OrderedDumper.add_representer(State, _dict_representer)
+
+
+def _atomic_write(file_path, content):
+    file_path = path(file_path).abspath()
+    fd, tmp_path = tempfile.mkstemp(
+        dir=file_path.dirname(), prefix='.%s.' % file_path.name)
+    try:
+        # mkstemp makes the file private, so give it the mode the file has
+        # now, or would have if it were created in the usual way.
+        if file_path.exists():
+            os.chmod(tmp_path, file_path.stat().st_mode)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_get_umask())
+        with io.open(fd, 'w', encoding='utf-8') as fo:
+            fo.write(six.text_type(content))
+            fo.flush()
+            os.fsync(fo.fileno())
+        _replace(tmp_path, file_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    _fsync_dir(file_path.dirname())
+
+
+def _get_umask():
+    # The umask can only be read by setting it.
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _fsync_dir(dir_path):
+    """Make a rename in `dir_path` durable, where that is possible."""
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return  # Directories can't be opened on Windows.
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# os.replace is atomic everywhere, but Python 2 only has os.rename, which is
+# atomic on POSIX.
+_replace = getattr(os, 'replace', os.rename)
+
+
 class StateLoader(object):
     def __init__(self, state_path):
         self.state_path = state_path
-        self.state = yaml_load(state_path)
+        self.state = State(yaml_load(state_path))
 
     def write_state(self, fp=None):
         if fp is None:
+            if not self.state.dirty:
+                logger.debug('State unchanged, not writing')
+                return False
             assert isinstance(self.state_path, six.string_types)
             fp = self.state_path
 
-        with open(fp, 'w') as fo:
-            state = yaml_dump(self.state)
-            fo.write(state)
+        _atomic_write(fp, yaml_dump(self.state))
+        if fp == self.state_path:
+            self.state.dirty = False
+        return True
 
     def reset(self):
         self.state.clear()
@@ -227,11 +904,525 @@ class SENTINEL(object):
     pass
 
 
+def _as_utc(time):
+    if time.tzinfo is None:
+        return pytz.UTC.localize(time)
+    return time.astimezone(pytz.UTC)
+
+
+def describe_command(command):
+    if isinstance(command, Mapping) and 'http' in command:
+        return six.u('%(method)s %(url)s') % command['http']
+    elif isinstance(command, Mapping):
+        return six.u('call %s') % command['call']
+    return command
+
+
+class ActionError(Exception):
+    pass
+
+
+class ActionTimeout(ActionError):
+    """An action ran out of time, but carries on running, and may yet do
+    whatever it was going to do.
+    """
+
+
+_ACTIONS = {}
+
+
+def load_action(target):
+    """Import an action callable, once per process.
+
+    `target` is either `package.module:callable` or the name of an entry point
+    in the `scriptter.actions` group.
+    """
+    try:
+        return _ACTIONS[target]
+    except KeyError:
+        pass
+
+    if ':' in target:
+        module_name, _, attrs = target.partition(':')
+        action = importlib.import_module(module_name)
+        for attr in attrs.split('.'):
+            action = getattr(action, attr)
+    else:
+        import pkg_resources
+        entry_points = list(
+            pkg_resources.iter_entry_points('scriptter.actions', target))
+        if not entry_points:
+            raise ActionError('No such action: %s' % target)
+        action = entry_points[0].load()
+
+    _ACTIONS[target] = action
+    return action
+
+
+def call_action(target, context, timeout=None):
+    action = load_action(target)
+    outcome = {}
+
+    def call():
+        try:
+            outcome['result'] = action(context)
+        except SystemExit as exc:
+            # Python CLIs tend to exit rather than return.
+            if exc.code:
+                outcome['error'] = exc
+        except Exception as exc:
+            outcome['error'] = exc
+
+    if timeout is None:
+        call()
+    else:
+        thread = threading.Thread(target=call, name='scriptter:%s' % target)
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            raise ActionTimeout(
+                '%s timed out after %s seconds' % (target, timeout))
+
+    if 'error' in outcome:
+        raise ActionError('%s failed: %r' % (target, outcome['error']))
+    return outcome.get('result')
+
+
+def _was_dropped(error):
+    """Whether `error` means the connection was gone before a request on it
+    could be sent, so that sending it again can't repeat it.
+    """
+    if isinstance(error, getattr(http_client, 'RemoteDisconnected', ())):
+        return True
+    return (
+        isinstance(error, socket.error) and
+        getattr(error, 'errno', None) in (errno.EPIPE, errno.ECONNRESET))
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP connections, reused per host.
+
+    At most `max_per_host` requests to any one host are in flight at once,
+    and a request waits at most `timeout` seconds at a time, unless told
+    otherwise. A request is only sent again if its reused connection turns
+    out to have been closed before the request went out. Once it has gone
+    out, any error or timeout raises `ActionTimeout`, since the server may
+    still act on it.
+    """
+    def __init__(self, max_per_host=4, timeout=60):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.slots = {}
+
+    def get_slot(self, key):
+        with self.lock:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[key]
+
+    def connect(self, key, timeout=None):
+        scheme, host, port = key
+        if scheme == 'https':
+            return http_client.HTTPSConnection(host, port, timeout=timeout)
+        return http_client.HTTPConnection(host, port, timeout=timeout)
+
+    def is_closed(self, connection):
+        # An idle connection has nothing to read, unless the server has
+        # closed it.
+        if connection.sock is None:
+            return False
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, ValueError):
+            return True
+
+    def checkout(self, key, timeout=None):
+        connection = None
+        with self.lock:
+            idle = self.idle.get(key) or []
+            while idle and connection is None:
+                connection = idle.pop()
+                if self.is_closed(connection):
+                    connection.close()
+                    connection = None
+        if connection is None:
+            return self.connect(key, timeout=timeout), False
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection, True
+
+    def checkin(self, key, connection):
+        with self.lock:
+            self.idle.setdefault(key, []).append(connection)
+
+    def discard(self, key):
+        with self.lock:
+            connections = self.idle.pop(key, [])
+        for connection in connections:
+            connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def request(self, method, url, headers=None, body=None, timeout=None):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = urlparse.urlunsplit(
+            ('', '', parts.path or '/', parts.query, ''))
+        if isinstance(body, six.text_type):
+            body = body.encode('utf-8')
+        if timeout is None:
+            timeout = self.timeout
+
+        slot = self.get_slot(key)
+        slot.acquire()
+        try:
+            connection, reused = self.checkout(key, timeout=timeout)
+            try:
+                connection.request(
+                    method, target, body=body, headers=headers or {})
+            except Exception as error:
+                connection.close()
+                if not (reused and _was_dropped(error)):
+                    raise
+                # The server closed the idle connection before the request
+                # went out, so the rest are probably stale too. Send it once
+                # more, on a new connection.
+                self.discard(key)
+                connection = self.connect(key, timeout=timeout)
+                try:
+                    connection.request(
+                        method, target, body=body, headers=headers or {})
+                except Exception:
+                    connection.close()
+                    raise
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except Exception as error:
+                connection.close()
+                raise ActionTimeout('%s %s sent, but failed: %r' % (
+                    method, url, error))
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.checkin(key, connection)
+        finally:
+            slot.release()
+
+        if response.status >= 400:
+            raise ActionError('%s %s returned %d %s' % (
+                method, url, response.status, response.reason))
+        return data
+
+
+HTTP = ConnectionPool()
+
+
+class SubprocessExecutor(object):
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else HTTP
+
+    def execute(self, command):
+        return subprocess.check_output(command)
+
+    def call(self, target, context, timeout=None):
+        return call_action(target, context, timeout=timeout)
+
+    def request(self, request, timeout=None):
+        return self.pool.request(
+            request['method'], request['url'], headers=request['headers'],
+            body=request['body'], timeout=timeout)
+
+
+Execution = namedtuple('Execution', ['time', 'command'])
+
+
+class RecordingExecutor(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.log = []
+
+    def execute(self, command):
+        self.log.append(
+            Execution(pytz.UTC.localize(self.clock.utcnow()), command))
+        return ''
+
+    def call(self, target, context, timeout=None):
+        return self.execute(['call', target])
+
+    def request(self, request, timeout=None):
+        return self.execute(['http', request['method'], request['url']])
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class NullTracer(object):
+    """Trace nothing, as cheaply as possible."""
+    def span(self, name, attributes=None):
+        return NULL_SPAN
+
+
+TRACER = NullTracer()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    elif isinstance(value, six.integer_types):
+        return {'intValue': str(value)}
+    elif isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': six.text_type(value)}
+
+
+class Span(object):
+    def __init__(self, tracer, name, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.trace_id = self.span_id = self.parent_id = None
+        self.start = self.end = None
+        self.error = None
+
+    def __enter__(self):
+        self.tracer.start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.error = '%s: %s' % (exc_type.__name__, exc_value)
+        self.tracer.finish(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_otlp(self):
+        return OrderedDict([
+            ('traceId', self.trace_id),
+            ('spanId', self.span_id),
+            ('parentSpanId', self.parent_id or ''),
+            ('name', self.name),
+            ('kind', 1),  # SPAN_KIND_INTERNAL
+            ('startTimeUnixNano', str(int(self.start * 1e9))),
+            ('endTimeUnixNano', str(int(self.end * 1e9))),
+            ('attributes', [
+                OrderedDict([('key', key), ('value', _otlp_value(value))])
+                for key, value in sorted(self.attributes.items())
+                if value is not None
+            ]),
+            ('status', (
+                OrderedDict([('code', 2), ('message', self.error)])
+                if self.error is not None else {})),  # ERROR or UNSET
+        ])
+
+
+class FileTracer(object):
+    """Append each finished trace to `trace_path` as a line of OTLP JSON.
+
+    Every line is a complete trace export request, so several processes can
+    share a file and any OTLP/JSON consumer can read it.
+    """
+    def __init__(self, trace_path, service='scriptter'):
+        self.trace_path = trace_path
+        self.service = service
+        self.stack = []
+        self.finished = []
+
+    def span(self, name, attributes=None):
+        return Span(self, name, attributes)
+
+    def start(self, span):
+        if self.stack:
+            span.trace_id = self.stack[-1].trace_id
+            span.parent_id = self.stack[-1].span_id
+        else:
+            span.trace_id = binascii.hexlify(os.urandom(16)).decode('ascii')
+        span.span_id = binascii.hexlify(os.urandom(8)).decode('ascii')
+        self.stack.append(span)
+        span.start = time.time()
+
+    def finish(self, span):
+        span.end = time.time()
+        self.stack.remove(span)
+        self.finished.append(span)
+        if not self.stack:
+            self.flush()
+
+    def flush(self):
+        if not self.finished:
+            return
+        finished, self.finished = self.finished, []
+        export = {'resourceSpans': [OrderedDict([
+            ('resource', {'attributes': [OrderedDict([
+                ('key', 'service.name'),
+                ('value', _otlp_value(self.service)),
+            ])]}),
+            ('scopeSpans', [OrderedDict([
+                ('scope', OrderedDict([
+                    ('name', 'scriptter'), ('version', __version__)])),
+                ('spans', [span.to_otlp() for span in finished]),
+            ])]),
+        ])]}
+        with open(self.trace_path, 'a', encoding='utf-8') as fo:
+            fo.write(json.dumps(export) + '\n')
+
+
+def _exit_status(error):
+    if isinstance(error, subprocess.CalledProcessError):
+        return error.returncode
+    elif isinstance(error, OSError):
+        # The shell's status for a command that can't be found or run.
+        return 127
+    return 1
+
+
+JOURNAL_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def _journal_time(time):
+    # A fixed width, so that times sort as strings.
+    return _as_utc(time).strftime(JOURNAL_TIME_FORMAT)
+
+
+def _journal_stamp(text):
+    when = dt.datetime.strptime(text, JOURNAL_TIME_FORMAT)
+    return (pytz.UTC.localize(when) - EPOCH).total_seconds()
+
+
+def _journal_key(schedule):
+    # Short, and free of spaces, for the index.
+    return hashlib.md5(schedule.encode('utf-8')).hexdigest()[:8]
+
+
+class Journal(object):
+    """An append-only record of everything run, in size-limited segments.
+
+    Each segment is a JSON lines file, named for when it was started. Beside
+    it, an index holds the time, byte offset and a hash of the schedule of
+    every record, so queries read only the records they need, and only from
+    the segments that have them.
+    """
+    segment_pattern = 'journal-*.jsonl'
+
+    def __init__(self, journal_dir, segment_size=4 * 1024 * 1024):
+        self.journal_dir = path(journal_dir)
+        self.segment_size = segment_size
+
+    def get_segments(self):
+        if not self.journal_dir.isdir():
+            return []
+        return sorted(self.journal_dir.files(self.segment_pattern))
+
+    def get_segment_start(self, segment):
+        return int(segment.namebase.split('-')[1]) / 1e6
+
+    def get_index_path(self, segment):
+        return segment.stripext() + '.idx'
+
+    def start_segment(self, stamp):
+        return self.journal_dir / ('journal-%020d.jsonl' % int(stamp * 1e6))
+
+    def append(self, record):
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        self.journal_dir.makedirs_p()
+        with io.open(self.journal_dir / 'lock', 'ab') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            stamp = time.time()
+            segments = self.get_segments()
+            if segments and segments[-1].size < self.segment_size:
+                segment = segments[-1]
+            else:
+                segment = self.start_segment(stamp)
+            with io.open(segment, 'ab') as fo:
+                offset = fo.tell()
+                fo.write(line)
+            if record.get('time'):
+                stamp = _journal_stamp(record['time'])
+            entry = '%.6f %d %s\n' % (
+                stamp, offset, _journal_key(record.get('schedule') or ''))
+            with io.open(self.get_index_path(segment), 'ab') as fo:
+                fo.write(entry.encode('ascii'))
+
+    def seek(self, segment, stamp, schedule=None):
+        """The offsets of the records in `segment` run at `stamp` or later,
+        and for `schedule`, if given.
+        """
+        key = None if schedule is None else _journal_key(schedule)
+        offsets = []
+        with io.open(self.get_index_path(segment), 'rb') as fi:
+            for line in fi:
+                entry_stamp, offset, entry_key = line.decode('ascii').split()
+                if float(entry_stamp) < stamp:
+                    continue
+                elif key is not None and entry_key != key:
+                    continue
+                offsets.append(int(offset))
+        return offsets
+
+    def query(self, since=None, schedule=None):
+        """Yield records run at `since` or later, optionally only for
+        `schedule`, oldest first.
+        """
+        if schedule is not None:
+            schedule = get_schedule_identity(schedule)
+        segments = self.get_segments()
+        stamp = 0
+        if since is not None:
+            stamp = (_as_utc(since) - EPOCH).total_seconds()
+            # Skip every segment finished before `since`. A record is written
+            # after the time it records, so none in them can be later.
+            starts = [self.get_segment_start(s) for s in segments]
+            segments = segments[
+                max(0, bisect.bisect_right(starts, stamp) - 1):]
+
+        for segment in segments:
+            offsets = self.seek(segment, stamp, schedule)
+            if not offsets:
+                continue
+            with io.open(segment, 'rb') as fi:
+                for offset in offsets:
+                    fi.seek(offset)
+                    record = json.loads(fi.readline().decode('utf-8'))
+                    # Schedules may share a hash.
+                    if schedule is None or record['schedule'] == schedule:
+                        yield record
+
+
 class Scriptter(object):
-    def __init__(self, schedule, state):
+    def __init__(self, schedule, state, executor=None, tracer=None,
+                 journal=None):
         self.state = state
         self.schedule = schedule
+        self.executor = (
+            executor if executor is not None else SubprocessExecutor())
+        self.tracer = tracer if tracer is not None else TRACER
+        self.journal = journal
         self.calendar = parsedatetime.Calendar()
+        self.random = random.Random()
 
     def get_scheduled_item(self):
         scheduled_item = None
@@ -250,11 +1441,19 @@ class Scriptter(object):
         when = self.state.get('when')
         if not when:
             when = self.get_next_run_time(item, now=now)
-        else:
+        elif when.tzinfo is None:
             when = pytz.UTC.localize(when)
 
         return when.astimezone(self.schedule.get_timezone())
 
+    def remember_run_time(self, item, when):
+        if not self.state.get('when'):
+            # Remember the first run time, rather than recomputing it (and
+            # pushing it back) on every run.
+            self.state['scheduled'] = item['id']
+            self.state['when'] = when
+            self.update_plan(item)
+
     def get_next_item_after(self, item):
         try:
             return self.schedule.next_after_id[item['id']]
@@ -266,7 +1465,7 @@ class Scriptter(object):
         delay = ctx['delay']
         tz = pytz.timezone(ctx['timezone'])
         if now is None:
-            now = pytz.UTC.localize(dt.datetime.utcnow())
+            now = self.schedule.clock.utcnow()
         if now.tzinfo is None:
             now = pytz.UTC.localize(now)
         now = now.astimezone(tz)
@@ -277,8 +1476,34 @@ class Scriptter(object):
             tzinfo=tz,
         )[0]
         logger.debug('Parsed `%s` as %s', delay, when)
+        if ctx.get('jitter') and self.is_anchored(delay, now, when, tz):
+            jitter = self.get_jitter(item, ctx['jitter'], when)
+            limit = int((when - now).total_seconds() * JITTER_LIMIT)
+            jitter = int(jitter.total_seconds()) % (max(limit, 0) + 1)
+            when = tz.normalize(when + dt.timedelta(seconds=jitter))
+            logger.debug('Jittered to %s', when)
         return when
 
+    def is_anchored(self, delay, now, when, tz):
+        """Whether `delay` names a time, like `tomorrow at 8am`, rather than a
+        span of time, like `30 minutes`, which moves with `now`.
+        """
+        later = self.calendar.parseDT(
+            delay, sourceTime=now + dt.timedelta(seconds=1), tzinfo=tz)[0]
+        return later == when
+
+    def get_jitter(self, item, span, now):
+        """A stable offset of up to `span`, unique to this schedule and item.
+
+        Spreads out items that would otherwise all run at the same moment,
+        such as everything scheduled for `tomorrow at 8am`.
+        """
+        span = self.parse_span(span, now).total_seconds()
+        key = six.u('%s:%s') % (
+            self.schedule.get_identity(), item.get('id'))
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return dt.timedelta(seconds=int(digest, 16) % (int(span) + 1))
+
     def set_next(self, item, now=None):
         next_item = self.get_next_item_after(item)
         if next_item is None:
@@ -287,9 +1512,136 @@ class Scriptter(object):
             next_id = next_item['id']
 
         self.state['scheduled'] = next_id
-        self.state['when'] = (
-            None if next_id is None
-            else self.get_next_run_time(next_item, now=now))
+        if next_id is None:
+            self.state['when'] = None
+        else:
+            with self.trace('get_next_run_time', next_id):
+                self.state['when'] = self.get_next_run_time(
+                    next_item, now=now)
+        self.update_plan(next_item)
+
+    def update_plan(self, item):
+        """Plan ahead from `item`, if the schedule asks for `lookahead`."""
+        if self.schedule.options.get('lookahead'):
+            self.state['plan'] = self.make_plan(item)
+        elif 'plan' in self.state:
+            del self.state['plan']
+
+    def make_plan(self, item):
+        """Render up to `lookahead` items, starting with `item`.
+
+        Each planned item keeps what it takes to run it and to work out when
+        it runs, so that due items can be run without loading the schedule.
+        """
+        size = self.schedule.options['lookahead']
+        now = self.schedule.get_now()
+        entries = []
+        first_id = None if item is None else item['id']
+        while item is not None and len(entries) < size:
+            entries.append(self.plan_item(item, now))
+            item = self.get_next_item_after(item)
+            if item is not None and item['id'] == first_id:
+                break
+
+        return OrderedDict([
+            ('options', OrderedDict(
+                (key, self.schedule.options[key])
+                for key in PLAN_OPTIONS if key in self.schedule.options)),
+            ('items', entries),
+            ('complete', item is None),
+            ('cycle', item is not None and item['id'] == first_id),
+        ])
+
+    def plan_item(self, item, now):
+        ctx = self.get_context(item)
+        entry = OrderedDict([
+            ('id', item['id']),
+            ('delay', ctx['delay']),
+            ('timezone', ctx['timezone']),
+            ('commands', self.get_commands(item)),
+            ('policy', self.get_retry_policy(item)),
+        ])
+        if ctx.get('jitter'):
+            entry['jitter'] = int(self.get_jitter(
+                item, ctx['jitter'], now).total_seconds())
+        idempotent = self.get_idempotent(item)
+        if idempotent:
+            entry['idempotent'] = idempotent
+        return entry
+
+    def trace(self, name, item_id=None):
+        return self.tracer.span(name, {
+            'scriptter.schedule': self.schedule.name,
+            'scriptter.item_id': item_id,
+        })
+
+    def get_cycle(self, item, start):
+        """Walk one cycle of the schedule, starting with `item` at `start`.
+
+        Returns the items in firing order, the offset in seconds of each from
+        `start`, and the length of the whole cycle in seconds (or None if the
+        schedule doesn't repeat).
+        """
+        items = [item]
+        offsets = [0.0]
+        cycle = None
+        when = start
+        current = item
+        for _ in range(len(self.schedule.items)):
+            current = self.get_next_item_after(current)
+            if current is None:
+                break
+            when = self.get_next_run_time(current, now=when)
+            if current['id'] == item['id']:
+                cycle = (when - start).total_seconds()
+                break
+            items.append(current)
+            offsets.append((when - start).total_seconds())
+        return items, offsets, cycle
+
+    def resync(self, now=None):
+        item = self.get_scheduled_item()
+        if item is None:
+            return False
+
+        if now is None:
+            now = self.schedule.get_now()
+        when = self.get_scheduled_run_time(item, now=now)
+        if when > now:
+            return False
+
+        items, offsets, cycle = self.get_cycle(item, when)
+        elapsed = (now - when).total_seconds()
+        skipped = 0
+        if cycle is not None and cycle > 0:
+            skipped, elapsed = divmod(elapsed, cycle)
+            skipped = int(skipped)
+        index = bisect.bisect_right(offsets, elapsed) - 1
+        current = items[index]
+        current_when = when + dt.timedelta(
+            seconds=skipped * (cycle or 0) + offsets[index])
+        if current['id'] == item['id'] and not skipped:
+            return False
+
+        logger.info(
+            "Resynced from %s at %s to %s at %s, skipping %d cycle(s)",
+            item['id'], when.isoformat(),
+            current['id'], current_when.isoformat(), skipped)
+        self.state['scheduled'] = current['id']
+        self.state['when'] = current_when
+        self.update_plan(current)
+        return True
+
+    def should_resync(self, when, now):
+        policy = self.schedule.options.get('resync')
+        if not policy or when > now:
+            return False
+        elif policy is True:
+            return True
+        tz = self.schedule.get_timezone()
+        threshold = self.calendar.parseDT(
+            policy, sourceTime=when.astimezone(tz), tzinfo=tz)[0]
+        return threshold <= now
 
     def get_context(self, item):
         ctx = {}
@@ -300,40 +1652,302 @@ class Scriptter(object):
 
         return ctx
 
+    def get_action_type(self, item):
+        # An item's own action wins; `cmd` always has a default, so it comes
+        # last.
+        for data in (item, self.schedule.options):
+            for key in ACTION_TYPES:
+                if key in data:
+                    return key
+
     def get_commands(self, item):
         ctx = self.get_context(item)
-        cmd = ctx['cmd']
-        if isinstance(cmd, six.string_types):
-            commands = [cmd]
-        elif isinstance(cmd, Iterable):
-            commands = list(cmd)
-
-        return [command.format(**ctx) for command in commands]
+        action_type = self.get_action_type(item)
+        actions = ctx[action_type]
+        if isinstance(actions, six.string_types):
+            actions = [actions]
+        elif isinstance(actions, Iterable):
+            actions = list(actions)
+
+        if action_type == 'call':
+            return [
+                OrderedDict([
+                    ('call', target),
+                    ('context', ctx),
+                    ('timeout', ctx.get('timeout')),
+                ])
+                for target in actions
+            ]
+        elif action_type == 'http':
+            if isinstance(ctx['http'], Mapping):
+                actions = [ctx['http']]
+            return [
+                OrderedDict([
+                    ('http', self.render_request(request, ctx)),
+                    ('timeout', ctx.get('timeout')),
+                ])
+                for request in actions
+            ]
+        return [command.format(**ctx) for command in actions]
+
+    def render_request(self, request, ctx):
+        headers = request.get('headers') or {}
+        body = request.get('body')
+        return OrderedDict([
+            ('method', request.get('method', 'POST').format(**ctx).upper()),
+            ('url', request['url'].format(**ctx)),
+            ('headers', OrderedDict(
+                (name, six.text_type(value).format(**ctx))
+                for name, value in headers.items())),
+            ('body', None if body is None else body.format(**ctx)),
+        ])
+
+    def run(self, dry_run=False, now=None):
+        if now is None:
+            now = self.schedule.get_now()
+        self.run_retries(now, dry_run=dry_run)
 
-    def run(self, dry_run=False):
-        item = self.get_scheduled_item()
+        with self.trace('get_scheduled_item') as span:
+            item = self.get_scheduled_item()
+            if item is not None:
+                span.set_attribute('scriptter.item_id', item['id'])
 
         if item is None:
             logger.warning("Nothing to do!")
             return
 
         when = self.get_scheduled_run_time(item)
-        now = self.schedule.get_now()
+
+        if self.should_resync(when, now) and self.resync(now=now):
+            item = self.get_scheduled_item()
+            when = self.get_scheduled_run_time(item)
+
+        if not dry_run:
+            self.remember_run_time(item, when)
 
         if when > now:
             for command in self.get_commands(item):
-                logger.warning("Will run `%s` at %s", command, when.isoformat())
+                logger.warning(
+                    "Will run `%s` at %s", describe_command(command),
+                    when.isoformat())
             return
 
         self.set_next(item)
         logger.debug('Running with item:\n%s', pprint.pformat(dict(item)))
 
-        for command in self.get_commands(item):
-            command = shlex.split(command)
-            logger.info("Running command: %r", command)
-            if not dry_run:
-                result = subprocess.check_output(command)
+        self.perform(
+            item['id'], self.get_commands(item), self.get_retry_policy(item),
+            now, dry_run=dry_run, idempotent=self.get_idempotent(item),
+            when=when)
+
+    def perform(self, item_id, commands, policy, now, attempt=1,
+                dry_run=False, idempotent=None, when=None):
+        idempotent = idempotent or {}
+        journaling = self.journal is not None and not dry_run
+        results = []
+        try:
+            for index, command in enumerate(commands):
+                template = None
+                if isinstance(command, six.string_types):
+                    template = idempotent.get(command)
+                if template is not None and self.is_repeat(
+                        template, command, now):
+                    logger.info("Skipping repeated command: %s", command)
+                    if journaling:
+                        results.append(self.get_result(command))
+                    continue
+
+                started = time.time()
+                try:
+                    with self.trace('execute', item_id) as span:
+                        span.set_attribute('scriptter.attempt', attempt)
+                        if span is not NULL_SPAN:
+                            span.set_attribute(
+                                'scriptter.command', describe_command(command))
+                        result = self.execute(command, dry_run=dry_run)
+                except Exception as error:
+                    if journaling:
+                        results.append(
+                            self.get_result(command, started, error))
+                    logger.exception(
+                        "Command failed: %s", describe_command(command))
+                    if template is not None:
+                        self.remember_invocation(template, None, now)
+                    if isinstance(error, ActionTimeout):
+                        # Retrying could do it twice, and later commands may
+                        # depend on it, so give up on the rest of the item.
+                        logger.error(
+                            "Not retrying item %s, since %s may still "
+                            "finish", item_id, describe_command(command))
+                        return False
+                    # This command may depend on earlier ones, such as one
+                    # that switches accounts, and later ones on this, so
+                    # retry the whole item.
+                    self.queue_retry(item_id, commands, policy, now, attempt,
+                                     idempotent=idempotent)
+                    return False
+                if dry_run:
+                    continue
+                if journaling:
+                    results.append(self.get_result(command, started))
                 logger.info("Result was: %s", result)
+                if template is not None:
+                    self.remember_invocation(template, command, now)
+            return True
+        finally:
+            if results:
+                self.write_journal(self.get_record(
+                    item_id, when, now, attempt, results))
+
+    def write_journal(self, record):
+        try:
+            self.journal.append(record)
+        except Exception:
+            # The commands have run and the state has moved on. Better to
+            # lose the record than to let the state go unsaved, and run them
+            # all again.
+            logger.exception(
+                "Could not write to the journal in %s",
+                self.journal.journal_dir)
+
+    def get_result(self, command, started=None, error=None):
+        """Describe how one command went, for the journal."""
+        result = OrderedDict([('command', describe_command(command))])
+        if started is None:
+            result['skipped'] = True
+        else:
+            result['status'] = 0 if error is None else _exit_status(error)
+            result['duration'] = round(time.time() - started, 6)
+        return result
+
+    def get_record(self, item_id, when, now, attempt, results):
+        return OrderedDict([
+            ('schedule', self.schedule.get_identity()),
+            ('item', item_id),
+            ('attempt', attempt),
+            ('scheduled', None if when is None else _journal_time(when)),
+            ('time', _journal_time(now)),
+            ('late', (
+                None if when is None
+                else (_as_utc(now) - _as_utc(when)).total_seconds())),
+            ('commands', results),
+        ])
+
+    def execute(self, command, dry_run=False):
+        if isinstance(command, Mapping) and 'http' in command:
+            logger.info("Requesting: %s", describe_command(command))
+            if not dry_run:
+                return self.executor.request(
+                    command['http'], timeout=command.get('timeout'))
+        elif isinstance(command, Mapping):
+            logger.info("Calling: %s", command['call'])
+            if not dry_run:
+                return self.executor.call(
+                    command['call'], command['context'],
+                    timeout=command.get('timeout'))
+        else:
+            args = shlex.split(command)
+            logger.info("Running command: %r", args)
+            if not dry_run:
+                return self.executor.execute(args)
+
+    def get_idempotent(self, item):
+        """Map each rendered idempotent command to its template."""
+        ctx = self.get_context(item)
+        templates = ctx.get('idempotent') or []
+        if isinstance(templates, six.string_types):
+            templates = [templates]
+        return dict(
+            (template.format(**ctx), template) for template in templates)
+
+    def is_repeat(self, template, command, now):
+        last = (self.state.get('idempotent') or {}).get(template)
+        if not last or last['command'] != command:
+            return False
+        window = self.schedule.options.get('idempotent_window')
+        if not window:
+            return True
+        return _as_utc(last['at']) + self.parse_span(window, now) > now
+
+    def remember_invocation(self, template, command, now):
+        invocations = OrderedDict(self.state.get('idempotent') or {})
+        if command is None:
+            invocations.pop(template, None)
+        else:
+            invocations[template] = OrderedDict([
+                ('command', command),
+                ('at', now),
+            ])
+        self.state['idempotent'] = invocations
+
+    def get_retry_policy(self, item):
+        policy = dict(RETRY_DEFAULTS)
+        retry = self.get_context(item).get('retry', True)
+        if isinstance(retry, Mapping):
+            policy.update(retry)
+        elif not retry:
+            policy['attempts'] = 1
+        return policy
+
+    def parse_span(self, span, now):
+        if isinstance(span, (int, float)):
+            return dt.timedelta(seconds=span)
+        tz = self.schedule.get_timezone()
+        now = now.astimezone(tz)
+        return self.calendar.parseDT(span, sourceTime=now, tzinfo=tz)[0] - now
+
+    def queue_retry(self, item_id, commands, policy, now, attempt,
+                    idempotent=None):
+        if attempt >= policy['attempts']:
+            logger.error(
+                "Giving up on item %s after %d attempt(s)", item_id, attempt)
+            return
+
+        backoff = self.parse_span(policy['backoff'], now)
+        backoff = backoff.total_seconds() * policy['factor'] ** (attempt - 1)
+        jitter = policy['jitter']
+        backoff *= 1 + self.random.uniform(-jitter, jitter)
+        when = now + dt.timedelta(seconds=backoff)
+        logger.warning(
+            "Will retry item %s (attempt %d) at %s",
+            item_id, attempt + 1, when.isoformat())
+
+        retry = OrderedDict([
+            ('item', item_id),
+            ('commands', list(commands)),
+            ('attempt', attempt + 1),
+            ('policy', policy),
+            ('when', when),
+        ])
+        if idempotent:
+            retry['idempotent'] = dict(idempotent)
+        # Reassign, rather than appending in place, so that the change is
+        # noticed and saved.
+        self.state['retries'] = list(self.state.get('retries') or []) + [
+            retry]
+
+    def run_retries(self, now, dry_run=False):
+        due, waiting = [], []
+        for retry in self.state.get('retries') or []:
+            if _as_utc(retry['when']) <= now:
+                due.append(retry)
+            else:
+                waiting.append(retry)
+
+        if not due:
+            return
+        elif dry_run:
+            for retry in due:
+                logger.warning("Will retry `%s`", '; '.join(
+                    describe_command(c) for c in retry['commands']))
+            return
+
+        self.state['retries'] = waiting
+        for retry in due:
+            self.perform(
+                retry['item'], retry['commands'], retry['policy'], now,
+                attempt=retry['attempt'], when=retry['when'],
+                idempotent=retry.get('idempotent'))
 
     def check(self):
         formatter = '%b %d, %Y at %X'
@@ -349,39 +1963,436 @@ class Scriptter(object):
                 six.u("%s -- (%s)") % (when.strftime(formatter), delay)
             ).encode('utf-8'))
             for command in self.get_commands(item):
-                print(command.encode('utf-8'))
+                print(describe_command(command).encode('utf-8'))
             now = when
         print('-----')
 
 
-def main():   # pragma: no cover
+class PlannedScriptter(Scriptter):
+    """Runs items from the plan in state, without loading the schedule."""
+    def can_run(self, now):
+        """Whether the plan is enough to run at `now`."""
+        scheduled = self.state.get('scheduled', SENTINEL)
+        if scheduled is None:
+            return True
+        item = self.schedule.by_id.get(scheduled)
+        if item is None or not self.state.get('when'):
+            return False
+        when = self.get_scheduled_run_time(item)
+        if when > now:
+            return True
+        elif self.should_resync(when, now):
+            return False
+        return (
+            self.schedule.complete or
+            self.get_next_item_after(item) is not None)
+
+    def get_commands(self, item):
+        return item['commands']
+
+    def get_retry_policy(self, item):
+        return item['policy']
+
+    def get_idempotent(self, item):
+        return item.get('idempotent') or {}
+
+    def get_jitter(self, item, span, now):
+        return dt.timedelta(seconds=span)
+
+    def make_plan(self, item):
+        plan = OrderedDict(self.schedule.plan)
+        items = self.schedule.items
+        if item is None:
+            plan['items'] = []
+        elif not self.schedule.cycle:
+            index = [entry['id'] for entry in items].index(item['id'])
+            plan['items'] = items[index:]
+        return plan
+
+
+def load_plan(state, name=None, tracer=TRACER, journal=None):
+    """A `PlannedScriptter` for `state`, if its plan can run now.
+
+    The plan can't be used once the schedule, or anything it extends, has
+    changed since it was made.
+    """
+    plan = state.get('plan')
+    if not plan or not sources_unchanged(state.get('sources')):
+        return None
+    # Freeze the clock, so that the plan is checked and run at the same time.
+    schedule = PlannedSchedule(
+        plan, clock=SimulatedClock(dt.datetime.utcnow()), name=name)
+    runner = PlannedScriptter(
+        schedule, state, tracer=tracer, journal=journal)
+    return runner if runner.can_run(schedule.get_now()) else None
+
+
+Due = namedtuple('Due', ['name', 'item', 'when', 'commands'])
+
+
+class ScheduleSet(object):
+    """Many schedules and their states, evaluated together.
+
+    `due` finds every item that should run by a given time, in one call, using
+    a heap ordered by run time. `perform` runs a due item's commands the way
+    `Scriptter.run` would, with retries and idempotent commands, and `commit`
+    then advances the state of each schedule that was run. `run` does all
+    three, after running any retries that are due.
+
+    Schedules added with `load` are reloaded by `reload` when a fragment they
+    extend changes.
+    """
+    def __init__(self, clock=None, executor=None, fragments=FRAGMENTS):
+        self.clock = clock if clock is not None else Clock()
+        self.executor = executor
+        self.fragments = fragments
+        self.sources = {}
+        self.calendar = parsedatetime.Calendar()
+        self.runners = OrderedDict()
+        self.pending = OrderedDict()
+        self.retrying = set()
+        self.queue = []
+        self.versions = {}
+        self.counter = it.count()
+
+    def __len__(self):
+        return len(self.runners)
+
+    def __contains__(self, name):
+        return name in self.runners
+
+    def add(self, name, schedule, state):
+        if schedule.name is None:
+            schedule.name = name
+        runner = Scriptter(schedule, state, executor=self.executor)
+        runner.calendar = self.calendar
+        self.runners[name] = runner
+        if state.get('retries'):
+            self.retrying.add(name)
+        self.push(name)
+        return runner
+
+    def remove(self, name):
+        self.runners.pop(name)
+        self.pending.pop(name, None)
+        self.versions.pop(name, None)
+        self.retrying.discard(name)
+        self.sources.pop(name, None)
+
+    def load(self, name, schedule_path, state, fmt=None):
+        loaded = ScheduleLoader(
+            schedule_path, fragments=self.fragments, fmt=fmt)
+        runner = self.add(name, Schedule(loaded.options, loaded.items), state)
+        self.sources[name] = (path(schedule_path).abspath(), fmt)
+        return runner
+
+    def reload(self):
+        """Reload the schedules that extend a fragment changed on disk.
+
+        Returns the names of the schedules reloaded.
+        """
+        stale = self.fragments.invalidate()
+        reloaded = []
+        for name, (schedule_path, fmt) in list(self.sources.items()):
+            if schedule_path in stale:
+                state = self.runners[name].state
+                self.remove(name)
+                self.load(name, schedule_path, state, fmt=fmt)
+                reloaded.append(name)
+        return reloaded
+
+    def push(self, name):
+        runner = self.runners[name]
+        version = self.versions[name] = next(self.counter)
+        item = runner.get_scheduled_item()
+        if item is None:
+            return
+        when = runner.get_scheduled_run_time(item, now=self.get_now())
+        runner.remember_run_time(item, when)
+        heapq.heappush(
+            self.queue, (when.astimezone(pytz.UTC), version, name))
+
+    def reindex(self):
+        """Rebuild the index after changing states outside of `commit`."""
+        del self.queue[:]
+        self.pending.clear()
+        self.retrying.clear()
+        for name, runner in self.runners.items():
+            if runner.state.get('retries'):
+                self.retrying.add(name)
+            self.push(name)
+
+    def get_now(self):
+        return pytz.UTC.localize(self.clock.utcnow())
+
+    def due(self, now=None):
+        if now is None:
+            now = self.get_now()
+
+        while self.queue and self.queue[0][0] <= now:
+            when, version, name = heapq.heappop(self.queue)
+            if self.versions.get(name) != version:
+                continue  # Stale entry
+            runner = self.runners[name]
+            if runner.should_resync(when, now) and runner.resync(now=now):
+                self.push(name)
+                continue
+            item = runner.get_scheduled_item()
+            self.pending[name] = Due(
+                name, item, when, runner.get_commands(item))
+
+        return sorted(self.pending.values(), key=lambda due: due.when)
+
+    def perform(self, due, now=None):
+        """Run the commands of a `due` item, retrying them later if they fail.
+        """
+        if now is None:
+            now = self.get_now()
+        runner = self.runners[due.name]
+        performed = runner.perform(
+            due.item['id'], due.commands, runner.get_retry_policy(due.item),
+            now, idempotent=runner.get_idempotent(due.item), when=due.when)
+        if runner.state.get('retries'):
+            self.retrying.add(due.name)
+        return performed
+
+    def run_retries(self, now=None):
+        if now is None:
+            now = self.get_now()
+        for name in sorted(self.retrying):
+            runner = self.runners[name]
+            runner.run_retries(now)
+            if not runner.state.get('retries'):
+                self.retrying.discard(name)
+
+    def run(self, now=None):
+        if now is None:
+            now = self.get_now()
+        self.run_retries(now)
+        due = self.due(now)
+        for result in due:
+            self.perform(result, now)
+        self.commit(due, now=now)
+        return due
+
+    def fire_times(self):
+        """The next run time of every schedule, by name."""
+        return OrderedDict(
+            (name, when) for when, version, name in sorted(self.queue)
+            if self.versions.get(name) == version)
+
+    def commit(self, results, now=None):
+        if now is None:
+            now = self.get_now()
+        for result in results:
+            if self.pending.get(result.name) != result:
+                logger.warning("%s is not due, ignoring", result.name)
+                continue
+            del self.pending[result.name]
+            self.runners[result.name].set_next(result.item, now=now)
+            self.push(result.name)
+
+
+EPOCH = pytz.UTC.localize(dt.datetime(1970, 1, 1))
+
+
+def fire_time_histogram(times, bucket=1, period=60):
+    """Count run times by where they fall within each `period` seconds."""
+    histogram = OrderedDict(
+        (start, 0) for start in range(0, int(period), int(bucket)))
+    for when in times:
+        offset = (_as_utc(when) - EPOCH).total_seconds() % period
+        histogram[int(offset // bucket) * int(bucket)] += 1
+    return histogram
+
+
+class Simulator(object):
+    """Drive a `Scriptter` through simulated cron runs at memory speed."""
+    def __init__(self, schedule, state=None, start=None,
+                 cadence=dt.timedelta(minutes=1)):
+        self.clock = schedule.clock = SimulatedClock(start)
+        self.cadence = cadence
+        self.executor = RecordingExecutor(self.clock)
+        self.scriptter = Scriptter(
+            schedule, state if state is not None else {},
+            executor=self.executor)
+        self.ticks = 0
+
+    @property
+    def log(self):
+        return self.executor.log
+
+    def run(self, duration):
+        end = self.clock.now + duration
+        while self.clock.now < end:
+            self.scriptter.run()
+            self.ticks += 1
+            self.clock.advance(self.cadence)
+        return self.ticks
+
+
+def main(argv=None):   # pragma: no cover
     logging.basicConfig()
-    arguments = docopt(__doc__, version='Scriptter {}'.format(__version__))
+    arguments = docopt(
+        __doc__, argv=argv, version='Scriptter {}'.format(__version__))
     if arguments.get('--verbose'):
         logger.setLevel(logging.DEBUG)
+    elif arguments['simulate']:
+        logger.setLevel(logging.ERROR)
     else:
         logger.setLevel(logging.INFO)
 
     logger.debug("Received arguments: %s", pprint.pformat(arguments))
-    loaded_schedule = ScheduleLoader(arguments['<schedule>'])
-
-    schedule = Schedule(loaded_schedule.options, loaded_schedule.items)
-
+    if arguments['convert']:
+        dump_all(
+            load_all(arguments['<schedule>'], arguments['--format']),
+            arguments['<output>'])
+        return
+    elif arguments['history']:
+        history(
+            arguments['--journal'] or './journal', arguments['--since'],
+            arguments['--schedule'])
+        return
+    elif arguments['histogram']:
+        histogram(
+            arguments['<schedules>'], fmt=arguments['--format'],
+            bucket=float(arguments['--bucket']),
+            period=float(arguments['--period']))
+        return
+
+    schedule_path = arguments['<schedule>']
+    tracer = (
+        FileTracer(arguments['--trace']) if arguments['--trace']
+        else TRACER)
+    with tracer.span('tick', {'scriptter.schedule': schedule_path}):
+        tick(arguments, tracer)
+
+
+def tick(arguments, tracer=TRACER):  # pragma: no cover
+    schedule_path = arguments['<schedule>']
+    attributes = {'scriptter.schedule': schedule_path}
     state_path = arguments.get('--state', './state.yml')
     state = StateLoader(state_path)
+    journal = (
+        Journal(arguments['--journal']) if arguments['--journal'] else None)
 
     if arguments['--reset']:
         state.reset()
         state.write_state()
 
-    scriptter = Scriptter(schedule, state.state)
+    scriptter = None
+    if arguments['run'] or arguments['trial']:
+        with tracer.span('load_plan', attributes):
+            scriptter = load_plan(
+                state.state, name=schedule_path, tracer=tracer,
+                journal=journal)
+
+    if scriptter is None:
+        with tracer.span('load', attributes):
+            # Compact schedules are built straight from the file, one item
+            # at a time, so most of the loading happens while indexing.
+            loaded_schedule = ScheduleLoader(
+                schedule_path, fmt=arguments['--format'],
+                stream=arguments['--compact'])
+
+        schedule_class = (
+            CompactSchedule if arguments['--compact'] else Schedule)
+        with tracer.span('index', attributes):
+            schedule = schedule_class(
+                loaded_schedule.options, loaded_schedule.items,
+                name=schedule_path)
+        sources = (
+            loaded_schedule.get_sources()
+            if schedule.options.get('lookahead') else None)
+        del loaded_schedule
+
+        scriptter = Scriptter(
+            schedule, state.state, tracer=tracer, journal=journal)
+        if sources != state.state.get('sources'):
+            # The schedule has changed, so plan again.
+            if sources:
+                state.state['sources'] = sources
+            else:
+                state.state.pop('sources', None)
+            scriptter.update_plan(scriptter.get_scheduled_item())
 
     if arguments['run'] or arguments['trial']:
         scriptter.run(dry_run=arguments['trial'])
         if arguments['run']:
-            state.write_state()
+            with tracer.span('write_state', attributes):
+                state.write_state()
     elif arguments['check']:
         scriptter.check()
+    elif arguments['resync']:
+        if scriptter.resync():
+            state.write_state()
+    elif arguments['simulate']:
+        simulate(
+            scriptter.schedule, copy.deepcopy(state.state),
+            start=arguments['--start'],
+            days=float(arguments['--days']),
+            cadence=float(arguments['--cadence']),
+        )
+
+
+def history(journal_dir, since, schedule):  # pragma: no cover
+    if since is not None:
+        now = pytz.UTC.localize(dt.datetime.utcnow())
+        since = parsedatetime.Calendar().parseDT(
+            since, sourceTime=now, tzinfo=pytz.UTC)[0]
+
+    for record in Journal(journal_dir).query(since=since, schedule=schedule):
+        late = record['late']
+        print('%s  %s  %s%s' % (
+            record['time'], record['schedule'], record['item'],
+            '' if late is None else '  (%.1fs late)' % late))
+        for result in record['commands']:
+            if result.get('skipped'):
+                outcome = 'skipped'
+            else:
+                outcome = 'exit %d in %.3fs' % (
+                    result['status'], result['duration'])
+            print(six.u('    %-20s %s') % (outcome, result['command']))
+
+
+def histogram(schedule_paths, fmt, bucket, period):  # pragma: no cover
+    times = []
+    for schedule_path in schedule_paths:
+        loaded = ScheduleLoader(schedule_path, fmt=fmt)
+        schedule = Schedule(loaded.options, loaded.items, name=schedule_path)
+        runner = Scriptter(schedule, {})
+        first = schedule.items[0]
+        start = runner.get_next_run_time(first, now=schedule.get_now())
+        times.extend(start + dt.timedelta(seconds=offset)
+                     for offset in runner.get_cycle(first, start)[1])
+
+    counts = fire_time_histogram(times, bucket=bucket, period=period)
+    scale = max(1.0, max(counts.values()) / 60.0)
+    for start, count in counts.items():
+        print('%6gs %-60s %d' % (start, '#' * int(count / scale), count))
+
+
+def simulate(schedule, state, start, days, cadence):  # pragma: no cover
+    tz = schedule.get_timezone()
+    start = parsedatetime.Calendar().parseDT(
+        start, sourceTime=schedule.get_now(), tzinfo=tz)[0]
+    simulator = Simulator(
+        schedule, state,
+        start=start.astimezone(pytz.UTC).replace(tzinfo=None),
+        cadence=dt.timedelta(minutes=cadence),
+    )
+
+    began = time.time()
+    ticks = simulator.run(dt.timedelta(days=days))
+    elapsed = time.time() - began
+
+    for execution in simulator.log:
+        print(six.u('%s  %s') % (
+            execution.time.astimezone(tz).isoformat(),
+            ' '.join(execution.command)))
+    print('-----')
+    print('%d ticks, %d commands in %.2fs (%.0f ticks/s)' % (
+        ticks, len(simulator.log), elapsed, ticks / max(elapsed, 1e-9)))
 
 
 if __name__ == '__main__':   # pragma: no cover
@@ -122,6 +122,7 @@ setup(
     # $ pip install -e .[dev,test]
     extras_require={
         'dev': ['check-manifest'],
+        'msgpack': ['msgpack'],
         'test': ['coverage', 'coveralls',
                  'ensure', 'green', 'mock', 'pep8', 'tox'],
     },
@@ -1,16 +1,27 @@
 # -*- coding: utf-8 -*-
 from collections import deque, OrderedDict
+import copy
 import datetime as dt
+import importlib
+import io
+import json
 import mock
+import os
 import unittest
 import pep8
+import socket
+import subprocess
 import tempfile
+import threading
+import time
 
 from ensure import ensure
 from path import path
 import pytz
 import six
+from six.moves import BaseHTTPServer, socketserver
 
+import benchmarks
 import scriptter
 
 
@@ -18,12 +29,34 @@ PATH = path(__file__).abspath().dirname()
 DATA = PATH / 'test-data'
 
 
+# Actions for ScriptterCallActionTests:
+ACTION_CALLS = []
+
+
+def record_action(context):
+    ACTION_CALLS.append(context)
+    return 'Posted as %s' % context['as']
+
+
+def failing_action(context):
+    raise RuntimeError('Boom!')
+
+
+def exiting_action(context):
+    raise SystemExit(context.get('exit_code', 0))
+
+
+def slow_action(context):
+    time.sleep(0.5)
+
+
 class TestCodeFormat(unittest.TestCase):
 
     def test_pep8_conformance(self):
         """Test that we conform to PEP8."""
         pep8style = pep8.StyleGuide(config_file=PATH / '.pep8')
-        result = pep8style.check_files(['scriptter.py', 'tests.py'])
+        result = pep8style.check_files(
+            ['scriptter.py', 'tests.py', 'benchmarks.py'])
         self.assertEqual(result.total_errors, 0,
                          "Found code style errors (and warnings).")
 
@@ -196,6 +229,185 @@ class ScheduleLoaderOptionsTests(unittest.TestCase):
         ).has_key('timezone').whose_value.equals('US/Eastern')  # noqa
 
 
+class ScheduleFormatTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = path(tempfile.mkdtemp())
+        self.yaml = DATA / 'schedule_with_defaults_and_ids.yaml'
+        self.jsonl = DATA / 'schedule_with_defaults_and_ids.jsonl'
+
+    def tearDown(self):
+        self.tmpdir.rmtree_p()
+
+    def assert_loads_like_yaml(self, loader):
+        expected = scriptter.ScheduleLoader(self.yaml)
+        ensure(loader.options).equals(expected.options)
+        ensure(loader.items).equals(expected.items)
+        ensure(list(loader.items[0])).equals(list(expected.items[0]))
+
+    def test_it_should_guess_the_format_from_the_extension(self):
+        ensure(scriptter.guess_format(self.jsonl)).equals('jsonl')
+        ensure(scriptter.guess_format('schedule.mpk')).equals('msgpack')
+        ensure(scriptter.guess_format(self.yaml)).equals('yaml')
+        ensure(scriptter.guess_format('foo: bar\nbaz: 1')).equals('yaml')
+
+    def test_it_should_load_json_lines_from_a_filepath(self):
+        self.assert_loads_like_yaml(scriptter.ScheduleLoader(self.jsonl))
+
+    def test_it_should_load_json_lines_from_a_string(self):
+        self.assert_loads_like_yaml(
+            scriptter.ScheduleLoader(self.jsonl.text(), fmt='jsonl'))
+
+    def test_it_should_load_json_lines_without_defaults(self):
+        loader = scriptter.ScheduleLoader(
+            '{"say": "Hi"}\n{"say": "Bye"}\n', fmt='jsonl')
+        ensure(loader.options).equals(scriptter.DEFAULTS)
+        ensure(loader.items).has_length(2)
+
+    def test_it_should_stream_documents(self):
+        documents = scriptter.load_all(self.jsonl)
+        ensure(next(documents)).contains('defaults')
+
+    def test_it_should_convert_between_formats(self):
+        jsonl = self.tmpdir / 'schedule.jsonl'
+        yaml = self.tmpdir / 'schedule.yaml'
+        scriptter.dump_all(scriptter.load_all(self.yaml), jsonl)
+        scriptter.dump_all(scriptter.load_all(jsonl), yaml)
+        self.assert_loads_like_yaml(scriptter.ScheduleLoader(jsonl))
+        self.assert_loads_like_yaml(scriptter.ScheduleLoader(yaml))
+
+    def test_it_should_convert_state_files_with_times(self):
+        state = DATA / 'test_state.yaml'
+        jsonl = self.tmpdir / 'state.jsonl'
+        yaml = self.tmpdir / 'state.yaml'
+        scriptter.dump_all(scriptter.load_all(state), jsonl)
+        ensure(jsonl.text()).contains('"when": "2015-05-05T20:07:31"')
+        scriptter.dump_all(scriptter.load_all(jsonl), yaml)
+        ensure(scriptter.StateLoader(yaml).state).equals(
+            scriptter.StateLoader(state).state)
+
+    def test_it_should_read_back_times_with_offsets(self):
+        document = next(scriptter.load_all(
+            '{"when": "2015-05-05T13:07:31.5-07:00", "say": "2015"}',
+            'jsonl'))
+        ensure(document['when']).equals(
+            dt.datetime(2015, 5, 5, 20, 7, 31, 500000))
+        ensure(document['say']).equals('2015')
+
+    @unittest.skipIf(scriptter.msgpack is None, 'requires msgpack')
+    def test_it_should_convert_state_files_to_messagepack(self):
+        state = DATA / 'test_state.yaml'
+        msgpack = self.tmpdir / 'state.msgpack'
+        scriptter.dump_all(scriptter.load_all(state), msgpack)
+        ensure(list(scriptter.load_all(msgpack))).equals(
+            list(scriptter.load_all(state)))
+
+    @unittest.skipIf(scriptter.msgpack is None, 'requires msgpack')
+    def test_it_should_load_messagepack(self):
+        msgpack = self.tmpdir / 'schedule.msgpack'
+        scriptter.dump_all(scriptter.load_all(self.yaml), msgpack)
+        self.assert_loads_like_yaml(scriptter.ScheduleLoader(msgpack))
+        self.assert_loads_like_yaml(
+            scriptter.ScheduleLoader(msgpack.bytes(), fmt='msgpack'))
+
+    def test_it_should_refuse_unknown_formats(self):
+        ensure(scriptter.load_all).called_with(
+            self.yaml, 'xml').raises(ValueError)
+
+
+class ScheduleLoaderExtendsTests(unittest.TestCase):
+    def setUp(self):
+        tmpdir = self.tmpdir = path(tempfile.mkdtemp())
+        (DATA / 'shared').copytree(tmpdir / 'shared')
+        for name in ('schedule_with_extends.yaml', 'another_schedule.yaml'):
+            (DATA / 'schedule_with_extends.yaml').copy(tmpdir / name)
+        self.fragments = scriptter.FragmentCache()
+
+    def tearDown(self):
+        self.tmpdir.rmtree_p()
+
+    def load(self, name='schedule_with_extends.yaml'):
+        return scriptter.ScheduleLoader(
+            self.tmpdir / name, fragments=self.fragments)
+
+    def test_it_should_extend_options_with_shared_fragments(self):
+        options = self.load().options
+        ensure(options).does_not_contain('extends')
+        ensure(
+            options
+        ).has_key('activate').whose_value.equals('t set active')  # noqa
+        ensure(
+            options
+        ).has_key('timezone').whose_value.equals('US/Eastern')  # noqa
+
+    def test_it_should_prefer_local_options_over_fragments(self):
+        options = self.load().options
+        ensure(options).has_key('delay').whose_value.equals('30min')  # noqa
+
+    def test_it_should_record_dependencies(self):
+        loader = self.load()
+        ensure(sorted(loader.dependencies)).equals([
+            self.tmpdir / 'shared' / 'timezone.yaml',
+            self.tmpdir / 'shared' / 'twitter.yaml',
+        ])
+
+    def test_it_should_parse_each_fragment_once(self):
+        with mock.patch(
+                'scriptter._load_yaml', wraps=scriptter._load_yaml) as patched:
+            self.load('schedule_with_extends.yaml')
+            self.load('another_schedule.yaml')
+            # Two schedules plus two fragments:
+            ensure(patched.call_count).equals(4)
+
+    def test_it_should_invalidate_only_dependents_of_changed_fragments(self):
+        self.load('schedule_with_extends.yaml')
+        other = self.tmpdir / 'other.yaml'
+        other.write_text(
+            u'defaults:\n  extends: shared/timezone.yaml\n---\nsay: Hi\n')
+        self.load('other.yaml')
+        ensure(self.fragments.invalidate()).is_empty()
+
+        (self.tmpdir / 'shared' / 'twitter.yaml').write_text(
+            u'update: t update\n', append=True)
+        ensure(self.fragments.invalidate()).equals(
+            set([self.tmpdir / 'schedule_with_extends.yaml']))
+
+        options = self.load().options
+        ensure(options).has_key('update').whose_value.equals('t update')  # noqa
+
+    def test_it_should_forget_superseded_fragments(self):
+        self.load()
+        ensure(self.fragments.parsed).has_length(2)
+        (self.tmpdir / 'shared' / 'twitter.yaml').write_text(
+            u'update: t update\n', append=True)
+        self.load()
+        ensure(self.fragments.parsed).has_length(2)
+
+    def test_it_should_reload_schedules_in_a_set(self):
+        schedules = scriptter.ScheduleSet(
+            clock=scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 12, 0)),
+            fragments=self.fragments)
+        state = {}
+        schedules.load('first', self.tmpdir / 'schedule_with_extends.yaml',
+                       state)
+        other = self.tmpdir / 'other.yaml'
+        other.write_text(
+            u'defaults:\n  extends: shared/timezone.yaml\n---\nsay: Hi\n')
+        schedules.load('other', other, {})
+        ensure(schedules.reload()).is_empty()
+
+        (self.tmpdir / 'shared' / 'twitter.yaml').write_text(
+            u'update: t update --now\n', append=True)
+        ensure(schedules.reload()).equals(['first'])
+        runner = schedules.runners['first']
+        ensure(runner.state).is_(state)
+        ensure(runner.schedule.options['update']).equals('t update --now')
+
+    def test_it_should_refuse_circular_extends(self):
+        (self.tmpdir / 'shared' / 'timezone.yaml').write_text(
+            u'extends: twitter.yaml\n')
+        ensure(self.load).called_with().raises(ValueError)
+
+
 class ScheduleConstructorTests(unittest.TestCase):
     def setUp(self):
         self.options, self.items = options, items = {}, []
@@ -276,6 +488,1200 @@ class ScheduleOperationsTests(unittest.TestCase):
         ).called_with().equals(pytz.timezone('US/Eastern'))
 
 
+class CompactScheduleOperationsTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+
+        self.items = loaded.items
+        self.schedule = scriptter.CompactSchedule(loaded.options, loaded.items)
+
+    def test_it_should_store_items_compactly(self):
+        ensure(self.schedule.items).has_length(3)
+        ensure(self.schedule.ids).is_a(list).of(six.binary_type)
+        ensure(self.schedule.columns).has_key('as')  # noqa
+
+    def test_it_should_present_items_as_mappings(self):
+        ensure(dict(self.schedule.items[0])).equals(dict(self.items[0]))
+        ensure(self.schedule.items[-1]['say']).equals(self.items[-1]['say'])
+
+    def test_it_should_get_items_by_id(self):
+        item = self.schedule.by_id['36292ccff3f811e4889bc82a1417f375']
+        ensure(item).has_key('say').whose_value.equals('Hello, world!')  # noqa
+        ensure(item['id']).equals('36292ccff3f811e4889bc82a1417f375')
+
+    def test_getting_a_nonexistent_items_by_id_raises_a_KeyError(self):
+        ensure(
+            self.schedule.by_id.__getitem__
+        ).called_with('foo').raises(KeyError)
+
+    def test_getting_a_missing_key_raises_a_KeyError(self):
+        item = self.schedule.items[0]
+        ensure(item.__getitem__).called_with('cmd').raises(KeyError)
+        ensure(item.get('cmd')).is_none()
+
+    def test_it_should_get_the_next_item_after_an_id(self):
+        item = self.schedule.next_after_id['36292ccff3f811e4889bc82a1417f375']
+        ensure(item).has_key('say').whose_value.equals('Hey, @eykd!')  # noqa
+
+    def test_it_should_wrap_around_when_getting_the_next_item_after_an_id(self):
+        item = self.schedule.next_after_id['4156347af3f811e4a134c82a1417f375']
+        ensure(item).has_key('say').whose_value.equals('Hello, world!')  # noqa
+
+    def test_it_should_not_wrap_around_when_repeat_is_False(self):
+        self.schedule.options['repeat'] = False
+        self.schedule.index()  # This will honor the new option
+        ensure(
+            self.schedule.next_after_id.__getitem__
+        ).called_with(
+            '4156347af3f811e4a134c82a1417f375'
+        ).raises(KeyError)
+
+    def test_it_should_assign_ids_like_a_schedule(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_without_defaults.yaml'
+        )
+        compact = scriptter.CompactSchedule(loaded.options, loaded.items)
+        schedule = scriptter.Schedule(loaded.options, loaded.items)
+        ensure(sorted(compact.by_id)).equals(sorted(schedule.by_id))
+
+    def test_it_should_render_commands(self):
+        item = self.schedule.by_id['3d13091cf3f811e4a8edc82a1417f375']
+        runner = scriptter.Scriptter(self.schedule, {})
+        ensure(runner.get_commands(item)).equals(
+            ['echo @worldsenoughstudios says: Hey, @eykd!'])
+
+    def test_it_should_build_from_a_stream_of_items(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml', stream=True)
+        ensure(loaded.items).is_not_a(list)
+        compact = scriptter.CompactSchedule(loaded.options, loaded.items)
+        ensure(sorted(compact.by_id)).equals(sorted(self.schedule.by_id))
+
+    @unittest.skipIf(benchmarks.tracemalloc is None, 'requires tracemalloc')
+    def test_it_should_peak_at_less_memory_than_a_schedule(self):
+        report = benchmarks.memory(2000, fmt='jsonl')
+        ensure(report['compact']['peak']).is_less_than(
+            report['schedule']['peak'])
+        ensure(report['ratio']).is_less_than(0.5)
+
+
+class FleetBenchmarkTests(unittest.TestCase):
+    def test_it_should_run_every_schedule_on_every_tick(self):
+        report = benchmarks.fleet(3, 5, 2, spread=0)
+        ensure(report['runs']).equals(6)
+        ensure(report['fired']).equals(3)
+        ensure(report['tick_seconds']['max']).is_greater_than(0)
+        ensure(report['lateness_seconds']['p50']).is_not_none()
+
+    def test_it_should_run_the_fleet_from_a_schedule_set(self):
+        report = benchmarks.fleet(3, 5, 2, mode='scheduleset', spread=0)
+        ensure(report['runs']).equals(6)
+        ensure(report['fired']).equals(3)
+        ensure(report['setup_seconds']).is_greater_than(0)
+
+
+class ScriptterResyncTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+
+        self.schedule = scriptter.Schedule(loaded.options, loaded.items)
+        self.tz = self.schedule.get_timezone()
+        self.state = {
+            'scheduled': '36292ccff3f811e4889bc82a1417f375',
+            'when': dt.datetime(2015, 12, 1, 13, 0),
+        }
+        self.scriptter = scriptter.Scriptter(self.schedule, self.state)
+
+    def localize(self, *args):
+        return self.tz.localize(dt.datetime(*args))
+
+    def test_it_should_skip_whole_cycles_and_find_the_current_item(self):
+        now = self.localize(2015, 12, 11, 8, 10)
+        ensure(self.scriptter.resync(now=now)).is_true()
+        ensure(self.state['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+        ensure(self.state['when']).equals(self.localize(2015, 12, 11, 8, 0, 30))
+
+    def test_it_should_find_an_item_later_in_the_cycle(self):
+        now = self.localize(2015, 12, 12, 8, 10)
+        ensure(self.scriptter.resync(now=now)).is_true()
+        ensure(self.state['scheduled']).equals(
+            '4156347af3f811e4a134c82a1417f375')
+        ensure(self.state['when']).equals(self.localize(2015, 12, 12, 8, 0))
+
+    def test_it_should_not_walk_every_missed_item(self):
+        now = self.localize(2025, 12, 11, 8, 10)
+        with mock.patch.object(
+                self.scriptter, 'get_next_run_time',
+                wraps=self.scriptter.get_next_run_time) as patched:
+            self.scriptter.resync(now=now)
+            ensure(patched.call_count).equals(len(self.schedule.items))
+
+    def test_it_should_do_nothing_when_not_behind(self):
+        now = self.localize(2015, 12, 1, 7, 0)
+        ensure(self.scriptter.resync(now=now)).is_false()
+        ensure(self.state['when']).equals(dt.datetime(2015, 12, 1, 13, 0))
+
+    def test_it_should_stop_at_the_last_item_when_not_repeating(self):
+        self.schedule.options['repeat'] = False
+        self.schedule.index()
+        now = self.localize(2015, 12, 11, 8, 10)
+        ensure(self.scriptter.resync(now=now)).is_true()
+        ensure(self.state['scheduled']).equals(
+            '4156347af3f811e4a134c82a1417f375')
+        ensure(self.state['when']).equals(self.localize(2015, 12, 2, 8, 0))
+
+    def test_it_should_resync_automatically_when_too_far_behind(self):
+        self.schedule.options['resync'] = '1 day'
+        now = self.localize(2015, 12, 11, 8, 10)
+        with mock.patch.object(self.schedule, 'get_now', return_value=now):
+            with mock.patch('subprocess.check_output') as patched:
+                self.scriptter.run()
+        ensure(patched.call_args[0][0]).equals(
+            ['echo', '@worldsenoughstudios', 'says:', 'Hey,', '@eykd!'])
+        ensure(self.state['scheduled']).equals(
+            '4156347af3f811e4a134c82a1417f375')
+
+    def test_it_should_not_resync_automatically_within_the_threshold(self):
+        self.schedule.options['resync'] = '1 day'
+        now = self.localize(2015, 12, 1, 20, 0)
+        with mock.patch.object(self.schedule, 'get_now', return_value=now):
+            with mock.patch('subprocess.check_output') as patched:
+                self.scriptter.run()
+        ensure(patched.call_args[0][0]).equals(
+            ['echo', '@eykd', 'says:', 'Hello,', 'world!'])
+
+
+class ScriptterJitterTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['jitter'] = '5 minutes'
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, name='bots/eykd.yaml')
+        self.scriptter = scriptter.Scriptter(self.schedule, {})
+        self.now = dt.datetime(2015, 12, 1, 12, 0)
+        self.anchor = self.schedule.get_timezone().localize(
+            dt.datetime(2015, 12, 2, 8, 0))
+
+    def run_time(self, item_id, name='bots/eykd.yaml'):
+        self.schedule.name = name
+        item = self.schedule.by_id[item_id]
+        return self.scriptter.get_next_run_time(item, now=self.now)
+
+    def test_it_should_spread_run_times_within_the_jitter(self):
+        when = self.run_time('36292ccff3f811e4889bc82a1417f375')
+        ensure(when).is_greater_than_or_equal_to(self.anchor)
+        ensure(when).is_less_than_or_equal_to(
+            self.anchor + dt.timedelta(minutes=5))
+
+    def test_it_should_be_stable(self):
+        ensure(
+            self.run_time('36292ccff3f811e4889bc82a1417f375')
+        ).equals(self.run_time('36292ccff3f811e4889bc82a1417f375'))
+
+    def test_it_should_differ_between_items_and_schedules(self):
+        times = set([
+            self.run_time('36292ccff3f811e4889bc82a1417f375'),
+            self.run_time('4156347af3f811e4a134c82a1417f375'),
+            self.run_time('36292ccff3f811e4889bc82a1417f375', 'other.yaml'),
+        ])
+        ensure(times).has_length(3)
+
+    def test_it_should_not_depend_on_how_the_path_is_spelled(self):
+        tmpdir = path(tempfile.mkdtemp())
+        self.addCleanup(tmpdir.rmtree_p)
+        (DATA / 'schedule_with_defaults_and_ids.yaml').copy(tmpdir / 'a.yaml')
+        (tmpdir / 'b').mkdir()
+        ensure(
+            self.run_time('36292ccff3f811e4889bc82a1417f375', tmpdir / 'a.yaml')
+        ).equals(self.run_time(
+            '36292ccff3f811e4889bc82a1417f375', tmpdir / 'b' / '..' / 'a.yaml'))
+
+    def test_it_should_prefer_the_schedules_own_name(self):
+        self.schedule.options['name'] = 'eykd'
+        ensure(
+            self.run_time('36292ccff3f811e4889bc82a1417f375', 'a.yaml')
+        ).equals(self.run_time('36292ccff3f811e4889bc82a1417f375', 'b.yaml'))
+
+    def test_it_should_not_jitter_relative_delays(self):
+        when = self.run_time('3d13091cf3f811e4a8edc82a1417f375')
+        ensure(when).equals(pytz.UTC.localize(
+            self.now + dt.timedelta(seconds=30)))
+
+    def test_it_should_limit_jitter_to_a_fraction_of_the_delay(self):
+        self.schedule.options['jitter'] = '1 day'
+        when = self.run_time('36292ccff3f811e4889bc82a1417f375')
+        ensure(when).is_less_than_or_equal_to(
+            self.anchor + dt.timedelta(hours=2))
+
+    def test_it_should_work_out_the_identity_once(self):
+        with mock.patch(
+                'scriptter.get_schedule_identity',
+                wraps=scriptter.get_schedule_identity) as patched:
+            self.run_time('36292ccff3f811e4889bc82a1417f375')
+            self.run_time('4156347af3f811e4a134c82a1417f375')
+        ensure(patched.call_count).equals(1)
+
+    def test_it_should_not_jitter_by_default(self):
+        del self.schedule.options['jitter']
+        ensure(
+            self.run_time('36292ccff3f811e4889bc82a1417f375')
+        ).equals(self.anchor)
+
+    def test_it_should_count_fire_times_in_a_histogram(self):
+        times = [
+            self.anchor,
+            self.anchor + dt.timedelta(seconds=1),
+            self.anchor + dt.timedelta(minutes=1, seconds=45),
+        ]
+        histogram = scriptter.fire_time_histogram(times, bucket=15)
+        ensure(histogram).equals({0: 2, 15: 0, 30: 0, 45: 1})
+        ensure(list(histogram)).equals([0, 15, 30, 45])
+
+    def test_it_should_report_fire_times_for_a_schedule_set(self):
+        schedules = scriptter.ScheduleSet()
+        schedules.add('a', self.schedule, {
+            'scheduled': '36292ccff3f811e4889bc82a1417f375',
+            'when': dt.datetime(2015, 12, 1, 13, 0),
+        })
+        ensure(self.schedule.name).equals('bots/eykd.yaml')
+        ensure(schedules.fire_times()).equals({
+            'a': pytz.UTC.localize(dt.datetime(2015, 12, 1, 13, 0)),
+        })
+
+
+class ScriptterRetryTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['cmd'] = ['echo {as}', 'echo {delay}']
+        loaded.options['retry'] = {
+            'attempts': 3, 'backoff': 60, 'factor': 2, 'jitter': 0}
+
+        self.clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 13, 0))
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, clock=self.clock)
+        self.executor = scriptter.RecordingExecutor(self.clock)
+        self.state = {
+            'scheduled': '36292ccff3f811e4889bc82a1417f375',
+            'when': dt.datetime(2015, 12, 1, 13, 0),
+        }
+        self.scriptter = scriptter.Scriptter(
+            self.schedule, self.state, executor=self.executor)
+
+    def fail(self, *failing):
+        execute = self.executor.execute
+
+        def fake_execute(command):
+            execute(command)
+            if command in failing:
+                raise subprocess.CalledProcessError(1, command)
+            return ''
+
+        return mock.patch.object(
+            self.executor, 'execute', side_effect=fake_execute)
+
+    def tick(self, minutes=1):
+        self.scriptter.run()
+        self.clock.advance(dt.timedelta(minutes=minutes))
+
+    def test_it_should_queue_failed_commands_for_retry(self):
+        with self.fail(['echo', 'eykd']):
+            self.tick()
+        ensure(self.state['retries']).has_length(1)
+        retry = self.state['retries'][0]
+        ensure(retry['item']).equals('36292ccff3f811e4889bc82a1417f375')
+        ensure(retry['commands']).equals(['echo eykd', 'echo tomorrow at 8am'])
+        ensure(retry['attempt']).equals(2)
+        ensure(retry['when']).equals(
+            pytz.UTC.localize(dt.datetime(2015, 12, 1, 13, 1)))
+
+    def test_it_should_retry_the_commands_a_failed_command_follows(self):
+        with self.fail(['echo', 'tomorrow', 'at', '8am']):
+            self.tick()
+        self.tick()
+        ensure([e.command for e in self.executor.log][:4]).equals([
+            ['echo', 'eykd'],
+            ['echo', 'tomorrow', 'at', '8am'],
+            ['echo', 'eykd'],
+            ['echo', 'tomorrow', 'at', '8am'],
+        ])
+
+    def test_it_should_keep_the_schedule_moving_after_a_failure(self):
+        with self.fail(['echo', 'eykd']):
+            self.tick()
+        ensure(self.state['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+
+    def test_it_should_retry_on_a_later_run(self):
+        with self.fail(['echo', 'eykd']):
+            self.tick()
+        self.tick()
+        ensure([e.command for e in self.executor.log]).equals([
+            ['echo', 'eykd'],
+            ['echo', 'eykd'],
+            ['echo', 'tomorrow', 'at', '8am'],
+            ['echo', 'worldsenoughstudios'],
+            ['echo', '30s'],
+        ])
+        ensure(self.state['retries']).is_empty()
+
+    def test_it_should_back_off_exponentially(self):
+        with self.fail(['echo', 'eykd']):
+            self.tick()
+            self.tick()
+        ensure(self.state['retries'][0]['attempt']).equals(3)
+        ensure(self.state['retries'][0]['when']).equals(
+            pytz.UTC.localize(dt.datetime(2015, 12, 1, 13, 3)))
+
+    def test_it_should_give_up_after_the_last_attempt(self):
+        with self.fail(['echo', 'eykd']):
+            with mock.patch('scriptter.logger.error') as patched:
+                for _ in range(10):
+                    self.tick()
+        ensure(self.state['retries']).is_empty()
+        ensure([
+            call for call in patched.call_args_list
+            if call[0][0].startswith('Giving up')
+        ]).has_length(1)
+        eykd = [e for e in self.executor.log if e.command == ['echo', 'eykd']]
+        ensure(eykd).has_length(3)
+
+    def test_it_should_retry_by_default(self):
+        del self.schedule.options['retry']
+        item = self.schedule.items[0]
+        ensure(self.scriptter.get_retry_policy(item)).equals(
+            scriptter.RETRY_DEFAULTS)
+
+    def test_it_should_not_retry_if_retries_are_disabled(self):
+        self.schedule.options['retry'] = False
+        with self.fail(['echo', 'eykd']):
+            self.tick()
+        ensure(self.state.get('retries')).is_none()
+
+    def test_it_should_survive_a_round_trip_through_yaml(self):
+        with self.fail(['echo', 'eykd']):
+            self.tick()
+        self.state = scriptter.yaml_load(scriptter.yaml_dump(self.state))
+        self.scriptter.state = self.state
+        self.tick()
+        ensure(self.state['retries']).is_empty()
+
+
+class ScriptterIdempotentCommandTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_idempotent_commands.yaml'
+        )
+        self.clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 13, 0))
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, clock=self.clock)
+        self.executor = scriptter.RecordingExecutor(self.clock)
+        self.state = {'when': dt.datetime(2015, 12, 1, 13, 0)}
+        self.scriptter = scriptter.Scriptter(
+            self.schedule, self.state, executor=self.executor)
+
+    def tick(self, count=1):
+        for _ in range(count):
+            self.scriptter.run()
+            self.clock.advance(dt.timedelta(minutes=1))
+
+    def activations(self):
+        return [
+            e.command[-1] for e in self.executor.log if e.command[1] == 'set'
+        ]
+
+    def test_it_should_skip_repeated_idempotent_commands(self):
+        self.tick(3)
+        ensure(self.activations()).equals(['Costello', 'Abbott'])
+        ensure(self.executor.log).has_length(5)
+
+    def test_it_should_rerun_when_the_command_changes(self):
+        self.tick(4)
+        ensure(self.activations()).equals(['Costello', 'Abbott', 'Costello'])
+
+    def test_it_should_remember_invocations_in_state(self):
+        self.tick(2)
+        ensure(self.state['idempotent']['{activate} {as}']).equals({
+            'command': 't set active Costello',
+            'at': pytz.UTC.localize(dt.datetime(2015, 12, 1, 13, 0)),
+        })
+
+    def test_it_should_rerun_outside_the_window(self):
+        self.schedule.options['idempotent_window'] = '30 seconds'
+        self.tick(3)
+        ensure(self.activations()).equals(['Costello', 'Costello', 'Abbott'])
+
+    def test_it_should_rerun_after_a_failure(self):
+        def fake_execute(command):
+            if command == ['t', 'set', 'active', 'Costello']:
+                raise subprocess.CalledProcessError(1, command)
+            return ''
+
+        with mock.patch.object(
+                self.executor, 'execute', side_effect=fake_execute):
+            self.scriptter.remember_invocation(
+                '{activate} {as}', 't set active Abbott',
+                self.schedule.get_now())
+            self.scriptter.perform(
+                'foo', ['t set active Costello'], {'attempts': 1},
+                self.schedule.get_now(),
+                idempotent={'t set active Costello': '{activate} {as}'})
+        ensure(self.state['idempotent']).is_empty()
+
+    def test_it_should_keep_the_idempotent_map_for_retries(self):
+        idempotent = {'t set active Costello': '{activate} {as}'}
+        with mock.patch.object(
+                self.executor, 'execute',
+                side_effect=subprocess.CalledProcessError(1, 't')):
+            self.scriptter.perform(
+                'foo', ['t set active Costello', 't post'],
+                dict(scriptter.RETRY_DEFAULTS),
+                self.schedule.get_now(), idempotent=idempotent)
+        retry = self.state['retries'][0]
+        ensure(retry['commands']).equals(['t set active Costello', 't post'])
+        ensure(retry['idempotent']).equals(idempotent)
+
+
+class ScriptterCallActionTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['call'] = 'tests:record_action'
+        loaded.options['retry'] = {'attempts': 2, 'backoff': 60, 'jitter': 0}
+
+        self.schedule = scriptter.Schedule(loaded.options, loaded.items)
+        self.state = {'when': dt.datetime(2015, 12, 1, 13, 0)}
+        self.scriptter = scriptter.Scriptter(self.schedule, self.state)
+        del ACTION_CALLS[:]
+
+    def test_it_should_prefer_call_in_the_defaults_to_the_default_cmd(self):
+        item = self.schedule.items[0]
+        ensure(self.scriptter.get_action_type(item)).equals('call')
+
+    def test_it_should_prefer_an_items_own_cmd(self):
+        item = self.schedule.items[0]
+        item['cmd'] = 'echo {as}'
+        ensure(self.scriptter.get_action_type(item)).equals('cmd')
+        ensure(self.scriptter.get_commands(item)).equals(['echo eykd'])
+
+    def test_it_should_render_call_actions(self):
+        item = self.schedule.items[0]
+        result = self.scriptter.get_commands(item)
+        ensure(result).has_length(1)
+        ensure(result[0]['call']).equals('tests:record_action')
+        ensure(result[0]['context']).equals(self.scriptter.get_context(item))
+
+    def test_it_should_call_actions_in_process(self):
+        with mock.patch('subprocess.check_output') as patched:
+            self.scriptter.run()
+            ensure(patched.call_count).equals(0)
+        ensure(ACTION_CALLS).has_length(1)
+        ensure(ACTION_CALLS[0]['say']).equals('Hello, world!')
+
+    def test_it_should_import_actions_once(self):
+        scriptter._ACTIONS.pop('tests:record_action', None)
+        with mock.patch(
+                'importlib.import_module',
+                wraps=importlib.import_module) as patched:
+            scriptter.load_action('tests:record_action')
+            action = scriptter.load_action('tests:record_action')
+            ensure(patched.call_count).equals(1)
+        ensure(action).is_(record_action)
+
+    def test_it_should_treat_exceptions_as_failures(self):
+        self.schedule.options['call'] = 'tests:failing_action'
+        self.scriptter.run()
+        ensure(self.state['retries']).has_length(1)
+        ensure(self.state['retries'][0]['commands'][0]['call']).equals(
+            'tests:failing_action')
+
+    def test_it_should_treat_a_clean_exit_as_success(self):
+        ensure(scriptter.call_action(
+            'tests:exiting_action', {'exit_code': 0})).is_none()
+
+    def test_it_should_treat_an_unclean_exit_as_a_failure(self):
+        ensure(scriptter.call_action).called_with(
+            'tests:exiting_action', {'exit_code': 2}
+        ).raises(scriptter.ActionError)
+
+    def test_it_should_time_out(self):
+        ensure(scriptter.call_action).called_with(
+            'tests:slow_action', {}, timeout=0.01
+        ).raises(scriptter.ActionTimeout)
+
+    def test_it_should_not_retry_calls_that_timed_out(self):
+        self.schedule.options['call'] = 'tests:slow_action'
+        self.schedule.options['timeout'] = 0.01
+        self.scriptter.run()
+        ensure(self.state.get('retries')).is_none()
+        ensure(self.state['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+
+    def test_it_should_refuse_unknown_entry_points(self):
+        ensure(scriptter.load_action).called_with(
+            'no-such-action'
+        ).raises(scriptter.ActionError)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        self.server.requests.append(
+            (self.client_address, self.path, dict(self.headers), body))
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+
+        status = 500 if b'fail' in body else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.active = self.peak = 0
+        self.delay = 0
+
+
+class ScriptterHTTPActionTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.pool = scriptter.ConnectionPool(max_per_host=2)
+
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['http'] = {
+            'url': self.url + '/bots/{as}',
+            'headers': {'Content-Type': 'text/plain', 'X-Bot': '{as}'},
+            'body': '{say}',
+        }
+        self.clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 13, 0))
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, clock=self.clock)
+        self.state = {'when': dt.datetime(2015, 12, 1, 13, 0)}
+        self.scriptter = scriptter.Scriptter(
+            self.schedule, self.state,
+            executor=scriptter.SubprocessExecutor(pool=self.pool))
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tick(self, count=1):
+        for _ in range(count):
+            self.scriptter.run()
+            self.clock.advance(dt.timedelta(minutes=1))
+
+    def test_it_should_render_requests(self):
+        item = self.schedule.items[0]
+        request = self.scriptter.get_commands(item)[0]['http']
+        ensure(request).equals({
+            'method': 'POST',
+            'url': self.url + '/bots/eykd',
+            'headers': {'Content-Type': 'text/plain', 'X-Bot': 'eykd'},
+            'body': 'Hello, world!',
+        })
+
+    def test_it_should_make_requests(self):
+        self.tick()
+        ensure(self.server.requests).has_length(1)
+        client, target, headers, body = self.server.requests[0]
+        ensure(target).equals('/bots/eykd')
+        ensure(headers['X-Bot']).equals('eykd')
+        ensure(body).equals(b'Hello, world!')
+
+    def test_it_should_reuse_connections(self):
+        self.tick(2)
+        self.pool.request('POST', self.url + '/other', body='Hi')
+        ensure(self.server.requests).has_length(3)
+        ensure(
+            set(client for client, _, _, _ in self.server.requests)
+        ).has_length(1)
+
+    def test_it_should_treat_error_responses_as_failures(self):
+        self.schedule.options['http']['body'] = 'fail'
+        self.tick()
+        ensure(self.state['retries']).has_length(1)
+        ensure(self.state['retries'][0]['commands'][0]['http']['url']).equals(
+            self.url + '/bots/eykd')
+
+    def test_it_should_not_resend_a_request_that_timed_out(self):
+        self.pool.request('POST', self.url + '/fast', body='Hi')
+        self.server.delay = 0.5
+        ensure(self.pool.request).called_with(
+            'POST', self.url + '/slow', body='Hi', timeout=0.2,
+        ).raises(scriptter.ActionTimeout)
+        ensure([target for _, target, _, _ in self.server.requests]).equals(
+            ['/fast', '/slow'])
+
+    def test_it_should_not_retry_items_whose_request_timed_out(self):
+        self.pool.timeout = 0.2
+        self.server.delay = 0.5
+        self.tick()
+        ensure(self.state.get('retries') or []).is_empty()
+        ensure(self.server.requests).has_length(1)
+
+    def test_it_should_time_out_by_default(self):
+        self.pool.timeout = 0.2
+        self.server.delay = 0.5
+        ensure(self.pool.request).called_with(
+            'POST', self.url + '/slow', body='Hi',
+        ).raises(scriptter.ActionTimeout)
+
+    def test_it_should_not_reuse_connections_the_server_has_closed(self):
+        self.pool.request('POST', self.url + '/first', body='Hi')
+        connection = self.pool.idle[('http', '127.0.0.1', self.port)][0]
+        # Hanging up our end makes the server close its end too.
+        connection.sock.shutdown(socket.SHUT_WR)
+        time.sleep(0.1)
+        self.pool.request('POST', self.url + '/second', body='Hi')
+        ensure(self.server.requests).has_length(2)
+        ensure(
+            set(client for client, _, _, _ in self.server.requests)
+        ).has_length(2)
+
+    def test_it_should_cap_concurrent_requests_per_host(self):
+        self.server.delay = 0.05
+        threads = [
+            threading.Thread(
+                target=self.pool.request,
+                args=('POST', self.url + '/', None, 'Hi'))
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ensure(self.server.requests).has_length(6)
+        ensure(self.server.peak).equals(2)
+
+
+class ScriptterTracingTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['call'] = 'tests:record_action'
+        loaded.options['retry'] = {'attempts': 2, 'backoff': 60, 'jitter': 0}
+
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, name='schedule.yaml')
+        self.state = {'when': dt.datetime(2015, 12, 1, 13, 0)}
+        self.tmpdir = path(tempfile.mkdtemp())
+        self.trace_path = self.tmpdir / 'trace.jsonl'
+        self.tracer = scriptter.FileTracer(self.trace_path)
+        self.scriptter = scriptter.Scriptter(
+            self.schedule, self.state, tracer=self.tracer)
+
+    def tearDown(self):
+        self.tmpdir.rmtree_p()
+
+    def read_traces(self):
+        return [
+            json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans']
+            for line in self.trace_path.lines()
+        ]
+
+    def attributes(self, span):
+        return dict(
+            (attribute['key'], list(attribute['value'].values())[0])
+            for attribute in span['attributes'])
+
+    def test_it_should_trace_nothing_by_default(self):
+        runner = scriptter.Scriptter(self.schedule, self.state)
+        ensure(runner.tracer).is_a(scriptter.NullTracer)
+        with runner.trace('tick') as span:
+            ensure(span).is_(scriptter.NULL_SPAN)
+
+    def test_it_should_write_one_line_per_trace(self):
+        with self.tracer.span('tick', {'scriptter.schedule': 'a.yaml'}):
+            self.scriptter.run()
+        with self.tracer.span('tick', {'scriptter.schedule': 'a.yaml'}):
+            pass
+        traces = self.read_traces()
+        ensure(traces).has_length(2)
+        ensure([span['name'] for span in traces[0]]).equals(
+            ['get_scheduled_item', 'get_next_run_time', 'execute', 'tick'])
+
+    def test_it_should_nest_spans_under_the_tick(self):
+        with self.tracer.span('tick'):
+            self.scriptter.run()
+        spans = self.read_traces()[0]
+        root = spans[-1]
+        ensure(root['parentSpanId']).equals('')
+        for span in spans[:-1]:
+            ensure(span['traceId']).equals(root['traceId'])
+            ensure(span['parentSpanId']).equals(root['spanId'])
+            ensure(int(span['endTimeUnixNano'])).is_greater_than_or_equal_to(
+                int(span['startTimeUnixNano']))
+
+    def test_it_should_record_the_schedule_and_item(self):
+        with self.tracer.span('tick'):
+            self.scriptter.run()
+        execute = self.read_traces()[0][2]
+        ensure(self.attributes(execute)).equals({
+            'scriptter.schedule': 'schedule.yaml',
+            'scriptter.item_id': '36292ccff3f811e4889bc82a1417f375',
+            'scriptter.attempt': '1',
+            'scriptter.command': 'call tests:record_action',
+        })
+
+    def test_it_should_mark_failed_commands_as_errors(self):
+        self.schedule.options['call'] = 'tests:failing_action'
+        with self.tracer.span('tick'):
+            self.scriptter.run()
+        execute = self.read_traces()[0][2]
+        ensure(execute['status']['code']).equals(2)
+        ensure(execute['status']['message']).contains('ActionError')
+
+
+class ScriptterLookaheadTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['lookahead'] = 2
+
+        self.clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 13, 0))
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, clock=self.clock)
+        self.state = {
+            'scheduled': '36292ccff3f811e4889bc82a1417f375',
+            'when': dt.datetime(2015, 12, 1, 13, 0),
+        }
+        self.executor = scriptter.RecordingExecutor(self.clock)
+        self.scriptter = scriptter.Scriptter(
+            self.schedule, self.state, executor=self.executor)
+
+    def planned(self, state):
+        schedule = scriptter.PlannedSchedule(state['plan'], clock=self.clock)
+        return scriptter.PlannedScriptter(
+            schedule, state, executor=self.executor)
+
+    def test_it_should_plan_ahead_when_setting_the_next_item(self):
+        self.scriptter.run()
+        plan = self.state['plan']
+        ensure([item['id'] for item in plan['items']]).equals([
+            '3d13091cf3f811e4a8edc82a1417f375',
+            '4156347af3f811e4a134c82a1417f375',
+        ])
+        ensure(plan['items'][0]['commands']).equals(
+            ['echo @worldsenoughstudios says: Hey, @eykd!'])
+        ensure(plan['items'][0]['delay']).equals('30s')
+        ensure(plan['options']).equals(
+            {'timezone': 'US/Eastern', 'lookahead': 2})
+        ensure(plan['complete']).is_false()
+        ensure(plan['cycle']).is_false()
+
+    def test_it_should_run_from_the_plan_like_the_schedule(self):
+        self.scriptter.run()
+        self.clock.advance(dt.timedelta(seconds=30))
+        state = copy.deepcopy(self.state)
+
+        self.scriptter.run()
+        planned = self.planned(state)
+        ensure(planned.can_run(self.schedule.get_now())).is_true()
+        planned.run()
+
+        ensure(state['scheduled']).equals(self.state['scheduled'])
+        ensure(state['when']).equals(self.state['when'])
+        ensure(self.executor.log[-1]).equals(self.executor.log[-2])
+        ensure([item['id'] for item in state['plan']['items']]).equals(
+            ['4156347af3f811e4a134c82a1417f375'])
+
+    def test_it_should_need_the_schedule_once_the_plan_runs_out(self):
+        self.scriptter.run()
+        self.clock.advance(dt.timedelta(seconds=30))
+        planned = self.planned(self.state)
+        planned.run()
+
+        planned = self.planned(self.state)
+        ensure(planned.can_run(self.schedule.get_now())).is_true()
+        self.clock.advance(dt.timedelta(days=1))
+        ensure(planned.can_run(self.schedule.get_now())).is_false()
+
+    def test_it_should_plan_a_whole_cycle_of_a_short_repeating_schedule(self):
+        self.schedule.options['lookahead'] = 10
+        self.scriptter.run()
+        plan = self.state['plan']
+        ensure(plan['items']).has_length(3)
+        ensure(plan['cycle']).is_true()
+        schedule = scriptter.PlannedSchedule(plan)
+        ensure(schedule.next_after_id[plan['items'][-1]['id']]).is_(
+            plan['items'][0])
+
+    def test_it_should_drop_the_plan_without_lookahead(self):
+        self.state['plan'] = {}
+        del self.schedule.options['lookahead']
+        self.scriptter.run()
+        ensure(self.state).does_not_contain('plan')
+
+    def test_it_should_not_load_a_plan_once_the_schedule_changes(self):
+        tmpdir = path(tempfile.mkdtemp())
+        self.addCleanup(tmpdir.rmtree_p)
+        schedule_path = tmpdir / 'schedule.yaml'
+        (DATA / 'schedule_with_defaults_and_ids.yaml').copy(schedule_path)
+
+        self.scriptter.run()
+        self.state['sources'] = scriptter.ScheduleLoader(
+            schedule_path).get_sources()
+        ensure(scriptter.load_plan(self.state)).is_a(
+            scriptter.PlannedScriptter)
+
+        schedule_path.write_text(schedule_path.text().replace('30s', '1min'))
+        ensure(scriptter.load_plan(self.state)).is_none()
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = path(tempfile.mkdtemp())
+        self.addCleanup(self.tmpdir.rmtree_p)
+        self.journal = scriptter.Journal(self.tmpdir, segment_size=200)
+
+    def at(self, seconds):
+        return scriptter.EPOCH + dt.timedelta(seconds=seconds)
+
+    def append(self, count, schedule='schedule.yaml'):
+        for n in range(count):
+            record = OrderedDict([
+                ('schedule', schedule),
+                ('item', 'item-%d' % n),
+                ('time', scriptter._journal_time(self.at(1000 + n))),
+            ])
+            with mock.patch('time.time', return_value=1000 + n):
+                self.journal.append(record)
+
+    def test_it_should_rotate_segments_by_size(self):
+        self.append(10)
+        segments = self.journal.get_segments()
+        ensure(len(segments)).is_greater_than(1)
+        for segment in segments[:-1]:
+            ensure(segment.size).is_greater_than_or_equal_to(200)
+        ensure(self.journal.get_segment_start(segments[0])).equals(1000)
+
+    def test_it_should_return_every_record_in_order(self):
+        self.append(10)
+        ensure([record['item'] for record in self.journal.query()]).equals(
+            ['item-%d' % n for n in range(10)])
+
+    def test_it_should_seek_to_records_since_a_time(self):
+        self.append(10)
+        records = self.journal.query(since=self.at(1006))
+        ensure([record['item'] for record in records]).equals(
+            ['item-6', 'item-7', 'item-8', 'item-9'])
+
+    def test_it_should_only_read_segments_it_needs(self):
+        self.append(10)
+        first = self.journal.get_segments()[0]
+        with mock.patch.object(
+                self.journal, 'seek', wraps=self.journal.seek) as seek:
+            list(self.journal.query(since=self.at(1008)))
+        ensure(first).is_not_in([c[0][0] for c in seek.call_args_list])
+
+    def test_it_should_filter_by_schedule(self):
+        self.append(2, schedule='a.yaml')
+        self.append(3, schedule='b.yaml')
+        records = list(self.journal.query(schedule='b.yaml'))
+        ensure(records).has_length(3)
+
+    def test_it_should_find_records_by_when_they_ran(self):
+        record = OrderedDict([
+            ('schedule', 'schedule.yaml'),
+            ('item', 'slow'),
+            ('time', scriptter._journal_time(self.at(900))),
+        ])
+        with mock.patch('time.time', return_value=1000):
+            self.journal.append(record)
+        records = list(self.journal.query(since=self.at(950)))
+        ensure(records).is_empty()
+        records = list(self.journal.query(since=self.at(900)))
+        ensure([r['item'] for r in records]).equals(['slow'])
+
+    def test_it_should_skip_segments_without_the_schedule(self):
+        self.append(4, schedule='a.yaml')
+        self.append(4, schedule='b.yaml')
+        first = self.journal.get_segments()[0]
+        with mock.patch('io.open', wraps=io.open) as patched:
+            records = list(self.journal.query(schedule='b.yaml'))
+        ensure(records).has_length(4)
+        ensure(first).is_not_in([c[0][0] for c in patched.call_args_list])
+
+    def test_it_should_return_nothing_from_an_empty_journal(self):
+        journal = scriptter.Journal(self.tmpdir / 'missing')
+        ensure(list(journal.query())).equals([])
+
+
+class ScriptterJournalTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        self.clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 13, 5))
+        self.schedule = scriptter.Schedule(
+            loaded.options, loaded.items, clock=self.clock,
+            name='schedule.yaml')
+        self.state = {
+            'scheduled': '36292ccff3f811e4889bc82a1417f375',
+            'when': dt.datetime(2015, 12, 1, 13, 0),
+        }
+        self.tmpdir = path(tempfile.mkdtemp())
+        self.addCleanup(self.tmpdir.rmtree_p)
+        self.journal = scriptter.Journal(self.tmpdir)
+        self.scriptter = scriptter.Scriptter(
+            self.schedule, self.state,
+            executor=scriptter.RecordingExecutor(self.clock),
+            journal=self.journal)
+
+    def test_it_should_record_each_run(self):
+        self.scriptter.run()
+        records = list(self.journal.query())
+        ensure(records).has_length(1)
+        record = records[0]
+        ensure(record['schedule']).equals('schedule.yaml')
+        ensure(record['item']).equals('36292ccff3f811e4889bc82a1417f375')
+        ensure(record['scheduled']).equals('2015-12-01T13:00:00.000000Z')
+        ensure(record['time']).equals('2015-12-01T13:05:00.000000Z')
+        ensure(record['late']).equals(300)
+        ensure(record['commands'][0]['command']).equals(
+            'echo @eykd says: Hello, world!')
+        ensure(record['commands'][0]['status']).equals(0)
+
+    def test_it_should_find_runs_however_the_path_is_spelled(self):
+        schedule_path = self.tmpdir / 'schedule.yaml'
+        (DATA / 'schedule_with_defaults_and_ids.yaml').copy(schedule_path)
+        self.schedule.name = self.tmpdir / 'b' / '..' / 'schedule.yaml'
+        (self.tmpdir / 'b').mkdir()
+        self.scriptter.run()
+        ensure(list(self.journal.query(schedule=schedule_path))).has_length(1)
+
+    def test_it_should_record_exit_codes_of_failed_commands(self):
+        with mock.patch.object(
+                self.scriptter.executor, 'execute',
+                side_effect=subprocess.CalledProcessError(3, 'echo')):
+            self.scriptter.run()
+        record = list(self.journal.query())[0]
+        ensure(record['commands'][0]['status']).equals(3)
+
+    def test_it_should_carry_on_if_the_journal_cant_be_written(self):
+        with mock.patch.object(
+                self.journal, 'append',
+                side_effect=IOError(28, 'No space left on device')):
+            with mock.patch.object(scriptter.logger, 'exception') as logged:
+                self.scriptter.run()
+        ensure(logged.call_count).equals(1)
+        ensure(self.state['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+
+    def test_it_should_not_record_trial_runs(self):
+        self.scriptter.run(dry_run=True)
+        ensure(list(self.journal.query())).equals([])
+
+    def test_it_should_not_record_runs_that_are_not_due(self):
+        self.clock.now = dt.datetime(2015, 12, 1, 12, 0)
+        self.scriptter.run()
+        ensure(list(self.journal.query())).equals([])
+
+
+class SimulatorTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        loaded.options['cmd'] = 'echo {as}'
+
+        self.schedule = scriptter.Schedule(loaded.options, loaded.items)
+        self.tz = self.schedule.get_timezone()
+        self.state = {}
+
+    def simulate(self, start, days):
+        simulator = scriptter.Simulator(
+            self.schedule, self.state, start=start)
+        simulator.run(dt.timedelta(days=days))
+        return simulator
+
+    def local_times(self, simulator):
+        return [
+            execution.time.astimezone(self.tz).replace(tzinfo=None)
+            for execution in simulator.log
+        ]
+
+    def test_it_should_use_the_simulated_clock(self):
+        clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 5, 0))
+        schedule = scriptter.Schedule(
+            self.schedule.options, self.schedule.items, clock=clock)
+        ensure(schedule.get_now()).equals(
+            self.tz.localize(dt.datetime(2015, 12, 1, 0, 0)))
+        clock.advance(dt.timedelta(hours=1))
+        ensure(schedule.get_now()).equals(
+            self.tz.localize(dt.datetime(2015, 12, 1, 1, 0)))
+
+    def test_it_should_tick_at_the_cadence(self):
+        simulator = self.simulate(dt.datetime(2015, 12, 1, 5, 0), 1)
+        ensure(simulator.ticks).equals(24 * 60)
+
+    def test_it_should_record_every_execution(self):
+        simulator = self.simulate(dt.datetime(2015, 11, 30, 5, 0), 4)
+        ensure(self.local_times(simulator)).equals([
+            dt.datetime(2015, 12, 1, 8, 0),
+            dt.datetime(2015, 12, 1, 8, 1),
+            dt.datetime(2015, 12, 2, 8, 0),
+            dt.datetime(2015, 12, 3, 8, 0),
+            dt.datetime(2015, 12, 3, 8, 1),
+        ])
+        ensure([e.command for e in simulator.log[:3]]).equals([
+            ['echo', 'eykd'],
+            ['echo', 'worldsenoughstudios'],
+            ['echo', 'somebodyelse'],
+        ])
+
+    def test_it_should_keep_local_times_across_DST_changes(self):
+        simulator = self.simulate(dt.datetime(2016, 3, 10, 5, 0), 6)
+        ensure(simulator.log).has_length(8)
+        ensure(
+            set(t.time() for t in self.local_times(simulator))
+        ).equals(set([dt.time(8, 0), dt.time(8, 1)]))
+
+    def test_it_should_not_run_commands(self):
+        with mock.patch('subprocess.check_output') as patched:
+            self.simulate(dt.datetime(2015, 12, 1, 5, 0), 2)
+            ensure(patched.call_count).equals(0)
+
+
+class ScheduleSetTests(unittest.TestCase):
+    def setUp(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        self.loaded = loaded
+        self.clock = scriptter.SimulatedClock(dt.datetime(2015, 12, 1, 12, 0))
+        self.executor = scriptter.RecordingExecutor(self.clock)
+        self.schedules = scriptter.ScheduleSet(
+            clock=self.clock, executor=self.executor)
+        self.states = {
+            'early': {
+                'scheduled': '36292ccff3f811e4889bc82a1417f375',
+                'when': dt.datetime(2015, 12, 1, 12, 30),
+            },
+            'late': {
+                'scheduled': '3d13091cf3f811e4a8edc82a1417f375',
+                'when': dt.datetime(2015, 12, 1, 13, 30),
+            },
+            'done': {'scheduled': None},
+        }
+        for name, state in sorted(self.states.items()):
+            schedule = scriptter.Schedule(loaded.options, loaded.items)
+            self.schedules.add(name, schedule, state)
+
+    def at(self, *args):
+        return pytz.UTC.localize(dt.datetime(*args))
+
+    def test_it_should_hold_many_schedules(self):
+        ensure(self.schedules).has_length(3)
+        ensure(self.schedules).contains('late')
+
+    def test_it_should_find_nothing_due_yet(self):
+        ensure(self.schedules.due()).is_empty()
+
+    def test_it_should_find_due_items_in_order(self):
+        due = self.schedules.due(self.at(2015, 12, 1, 14, 0))
+        ensure([d.name for d in due]).equals(['early', 'late'])
+        ensure(due[0].when).equals(self.at(2015, 12, 1, 12, 30))
+        ensure(due[0].item['id']).equals('36292ccff3f811e4889bc82a1417f375')
+        ensure(due[1].commands).equals(
+            ['echo @worldsenoughstudios says: Hey, @eykd!'])
+
+    def test_it_should_find_only_items_due_by_now(self):
+        due = self.schedules.due(self.at(2015, 12, 1, 13, 0))
+        ensure([d.name for d in due]).equals(['early'])
+
+    def test_it_should_keep_returning_uncommitted_items(self):
+        now = self.at(2015, 12, 1, 13, 0)
+        ensure(self.schedules.due(now)).equals(self.schedules.due(now))
+
+    def test_it_should_advance_state_on_commit(self):
+        now = self.at(2015, 12, 1, 14, 0)
+        self.schedules.commit(self.schedules.due(now), now=now)
+        ensure(self.states['early']['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+        ensure(self.states['late']['scheduled']).equals(
+            '4156347af3f811e4a134c82a1417f375')
+        ensure(self.schedules.due(now)).is_empty()
+
+        due = self.schedules.due(self.at(2015, 12, 1, 14, 1))
+        ensure([d.name for d in due]).equals(['early'])
+
+    def test_it_should_ignore_commits_for_items_not_due(self):
+        stale = self.schedules.due(self.at(2015, 12, 1, 13, 0))
+        self.schedules.commit(stale)
+        self.schedules.commit(stale)
+        ensure(self.states['early']['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+
+    def test_it_should_schedule_new_states_by_its_own_clock(self):
+        schedule = scriptter.Schedule(self.loaded.options, self.loaded.items)
+        self.schedules.add('fresh', schedule, {})
+        ensure(self.schedules.fire_times()['fresh']).equals(
+            self.at(2015, 12, 2, 13, 0))
+
+    def test_it_should_run_due_items(self):
+        due = self.schedules.run(self.at(2015, 12, 1, 14, 0))
+        ensure([d.name for d in due]).equals(['early', 'late'])
+        ensure([e.command[-1] for e in self.executor.log]).equals(
+            ['world!', '@eykd!'])
+        ensure(self.states['early']['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+
+    def test_it_should_retry_failed_items(self):
+        with mock.patch.object(
+                self.executor, 'execute',
+                side_effect=subprocess.CalledProcessError(1, 'echo')):
+            self.schedules.run(self.at(2015, 12, 1, 13, 0))
+        ensure(self.states['early']['retries']).has_length(1)
+        ensure(self.states['early']['scheduled']).equals(
+            '3d13091cf3f811e4a8edc82a1417f375')
+
+        self.schedules.run(self.at(2015, 12, 1, 13, 5))
+        ensure(self.states['early']['retries']).is_empty()
+        ensure(self.executor.log[0].command[-1]).equals('world!')
+
+    def test_it_should_forget_removed_schedules(self):
+        self.schedules.remove('early')
+        due = self.schedules.due(self.at(2015, 12, 1, 14, 0))
+        ensure([d.name for d in due]).equals(['late'])
+
+
 class StateLoaderOperationsTests(unittest.TestCase):
     def setUp(self):
         tmpdir = self.tmpdir = path(tempfile.mkdtemp())
@@ -310,6 +1716,92 @@ class StateLoaderOperationsTests(unittest.TestCase):
         self.loader.reset()
         ensure(self.loader.state).is_empty()
 
+    def test_it_should_not_write_unchanged_state(self):
+        self.loader.state['scheduled'] = self.loader.state['scheduled']
+        with mock.patch('scriptter._atomic_write') as patched:
+            ensure(self.loader.write_state()).is_false()
+            ensure(patched.call_count).equals(0)
+
+    def test_it_should_write_state_atomically(self):
+        self.loader.state['next'] = 'foo'
+        with mock.patch('scriptter._replace') as patched:
+            self.loader.write_state()
+            ensure(patched.call_count).equals(1)
+        ensure(patched.call_args[0][1]).equals(self.state_path)
+        ensure(self.tmpdir.files()).has_length(2)
+
+    def test_it_should_keep_the_mode_of_the_state_file(self):
+        self.state_path.chmod(0o640)
+        self.loader.state['next'] = 'foo'
+        self.loader.write_state()
+        ensure(self.state_path.stat().st_mode & 0o777).equals(0o640)
+
+    def test_it_should_create_state_files_with_the_usual_mode(self):
+        new_path = self.tmpdir / 'new.yaml'
+        umask = os.umask(0o022)
+        self.addCleanup(os.umask, umask)
+        scriptter._atomic_write(new_path, 'next: foo\n')
+        ensure(new_path.stat().st_mode & 0o777).equals(0o644)
+
+    def test_it_should_sync_the_directory_after_writing(self):
+        self.loader.state['next'] = 'foo'
+        with mock.patch('scriptter._fsync_dir') as patched:
+            self.loader.write_state()
+        ensure(patched.call_args[0][0]).equals(self.tmpdir)
+
+    def test_it_should_not_leave_temporary_files_behind(self):
+        self.loader.state['next'] = 'foo'
+        with mock.patch('scriptter._replace', side_effect=OSError):
+            ensure(self.loader.write_state).called_with().raises(OSError)
+        ensure(self.tmpdir.files()).equals([self.state_path])
+        ensure(scriptter.StateLoader(self.state_path).state).does_not_contain(
+            'next')
+
+    def test_it_should_only_write_changed_state_over_a_day_of_runs(self):
+        loaded = scriptter.ScheduleLoader(
+            DATA / 'schedule_with_defaults_and_ids.yaml'
+        )
+        clock = scriptter.SimulatedClock(dt.datetime(2015, 11, 30, 20, 0))
+        schedule = scriptter.Schedule(loaded.options, loaded.items, clock)
+        executor = scriptter.RecordingExecutor(clock)
+        self.loader.reset()
+        self.loader.write_state()
+        runner = scriptter.Scriptter(schedule, self.loader.state, executor)
+
+        with mock.patch('os.fsync') as patched:
+            for _ in range(24 * 60):
+                runner.run()
+                self.loader.write_state()
+                clock.advance(dt.timedelta(minutes=1))
+
+        # Once to record the first run time, then once per item run, each
+        # syncing the file and then its directory:
+        ensure(executor.log).has_length(2)
+        ensure(patched.call_count).equals(6)
+
+
+class StateTests(unittest.TestCase):
+    def setUp(self):
+        self.state = scriptter.State([('scheduled', 'foo')])
+
+    def test_it_should_start_clean(self):
+        ensure(self.state.dirty).is_false()
+
+    def test_it_should_ignore_unchanged_values(self):
+        self.state['scheduled'] = 'foo'
+        ensure(self.state.dirty).is_false()
+
+    def test_it_should_track_changed_values(self):
+        self.state['scheduled'] = 'bar'
+        ensure(self.state.dirty).is_true()
+
+    def test_it_should_track_removed_values(self):
+        self.state.pop('scheduled')
+        ensure(self.state.dirty).is_true()
+
+    def test_it_should_dump_like_a_mapping(self):
+        ensure(scriptter.yaml_dump(self.state)).equals('scheduled: foo\n')
+
 
 class ScriptterConstructorTests(unittest.TestCase):
     def setUp(self):